@@ -4,7 +4,11 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from apscheduler.schedulers.background import BackgroundScheduler
 from config import Config
-from models import db
+from models import db, upgrade_schema, enable_raise_on_lazy_load
+from settings_cache import get_settings_map
+import events
+from json_provider import OrjsonProvider
+from upload_request import UploadRequest, check_werkzeug_parser
 from datetime import datetime
 import atexit
 import logging
@@ -18,6 +22,9 @@ def create_app(config_class=Config):
     
     app = Flask(__name__, static_folder='static', static_url_path='')
     app.config.from_object(config_class)
+    app.json = OrjsonProvider(app)
+    check_werkzeug_parser()
+    app.request_class = UploadRequest
     
     # Setup logging
     if not os.path.exists('logs'):
@@ -114,10 +121,19 @@ def create_app(config_class=Config):
     # Create database tables
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+        # Load settings now so the first request after a restart isn't the cold miss
+        get_settings_map()
+    
+    if app.config.get('RAISE_ON_LAZY_LOAD'):
+        enable_raise_on_lazy_load()
     
     # Add cache control headers for static files to prevent stale caching
     @app.after_request
     def add_cache_headers(response):
+        # Leave responses that already chose a max-age (e.g. send_file) alone
+        if response.cache_control.max_age is not None:
+            return response
         # Don't cache JavaScript and CSS files aggressively
         if request.path.endswith(('.js', '.css')):
             response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -176,8 +192,9 @@ def check_scheduled_posts():
     """
     Background task to check and publish scheduled posts.
     """
-    from models import Post, User, Team, Settings, db
-    from instagram_api import InstagramAPI
+    from models import Post, User, Team, db
+    from instagram_api import shared_api as ig_api
+    from routes.posts import public_media_urls
     
     with scheduler_app.app_context():
         scheduler_app.logger.info('=' * 80)
@@ -200,8 +217,6 @@ def check_scheduled_posts():
             scheduler_app.logger.info('No scheduled posts found. Exiting.')
             return
         
-        ig_api = InstagramAPI()
-        
         for post in posts:
             try:
                 scheduler_app.logger.info(f'\n--- Processing Post {post.id} ---')
@@ -209,8 +224,12 @@ def check_scheduled_posts():
                 scheduler_app.logger.info(f'Post caption length: {len(post.caption or "")}')
                 scheduler_app.logger.info(f'Post media count: {len(post.media)}')
                 
-                # Update status immediately to prevent duplicate publishing attempts
-                post.status = 'publishing'
+                # Claim the post so a concurrent publish-now can't send it too
+                if not Post.claim_for_publishing(post.id, ['scheduled']):
+                    db.session.rollback()
+                    scheduler_app.logger.info(f'Post {post.id} is already being published, skipping')
+                    continue
+                User.bump_dashboard_version(post.user_id)
                 db.session.commit()
                 scheduler_app.logger.info(f'Updated post {post.id} status to publishing')
                 
@@ -219,6 +238,7 @@ def check_scheduled_posts():
                 if not user:
                     post.status = 'failed'
                     post.error_message = 'User not found'
+                    User.bump_dashboard_version(post.user_id)
                     db.session.commit()
                     scheduler_app.logger.error(f'User {post.user_id} not found for post {post.id}')
                     continue
@@ -227,6 +247,7 @@ def check_scheduled_posts():
                 if not hasattr(user, 'team_memberships') or not user.team_memberships:
                     post.status = 'failed'
                     post.error_message = 'User is not a member of any team'
+                    User.bump_dashboard_version(post.user_id)
                     db.session.commit()
                     scheduler_app.logger.error(f'User {user.id} is not a member of any team')
                     continue
@@ -235,6 +256,7 @@ def check_scheduled_posts():
                 if not team:
                     post.status = 'failed'
                     post.error_message = 'Team not found'
+                    User.bump_dashboard_version(post.user_id)
                     db.session.commit()
                     scheduler_app.logger.error(f'Team not found for user {user.id}')
                     continue
@@ -246,6 +268,7 @@ def check_scheduled_posts():
                 if not team.instagram_access_token or not team.instagram_account_id:
                     post.status = 'failed'
                     post.error_message = 'Instagram not connected'
+                    User.bump_dashboard_version(post.user_id)
                     db.session.commit()
                     scheduler_app.logger.error(f'Instagram not connected for team {team.id}. Token: {bool(team.instagram_access_token)}, Account ID: {bool(team.instagram_account_id)}')
                     continue
@@ -254,20 +277,13 @@ def check_scheduled_posts():
                 if not post.media:
                     post.status = 'failed'
                     post.error_message = 'No media files attached'
+                    User.bump_dashboard_version(post.user_id)
                     db.session.commit()
                     scheduler_app.logger.error(f'Post {post.id} has no media files')
                     continue
                 
-                # Get the public host URL from settings, fallback to environment variable
-                domain_setting = Settings.query.filter_by(key='app_domain').first()
-                app_host = domain_setting.value if domain_setting else os.getenv('APP_HOST', 'http://127.0.0.1:5500')
-                scheduler_app.logger.info(f'Using app host: {app_host}')
-                
-                # Prepare publicly accessible media URLs
-                media_urls = [
-                    f"{app_host}/api/posts/media/{media.id}"
-                    for media in post.media
-                ]
+                # Prepare signed, publicly accessible media URLs
+                media_urls = public_media_urls(post)
                 
                 scheduler_app.logger.info(f'Publishing post {post.id} with {len(media_urls)} media items')
                 scheduler_app.logger.info(f'Media URLs: {media_urls}')
@@ -292,11 +308,15 @@ def check_scheduled_posts():
                 scheduler_app.logger.error(f'Failed to publish post {post.id}: {str(e)}', exc_info=True)
                 post.status = 'failed'
                 post.error_message = str(e)
+                User.bump_dashboard_version(post.user_id)
                 db.session.commit()
+                events.publish(post.user_id, 'post_status', {'post_id': post.id, 'status': 'failed'})
             
             else:
                 # Only commit if no exception occurred
+                User.bump_dashboard_version(post.user_id)
                 db.session.commit()
+                events.publish(post.user_id, 'post_status', {'post_id': post.id, 'status': post.status})
         
         scheduler_app.logger.info('=' * 80)
         scheduler_app.logger.info('Finished check_scheduled_posts task')
@@ -324,12 +344,11 @@ def refresh_instagram_cache():
     Runs every 30 minutes for all active users.
     """
     from models import User
-    from instagram_api import InstagramAPI
+    from instagram_api import shared_api as ig_api
     from cache_manager import CacheManager
     
     with scheduler_app.app_context():
         try:
-            ig_api = InstagramAPI()
             users = User.query.filter(User.instagram_account_id.isnot(None)).all()
             
             refreshed_count = 0
@@ -345,6 +364,7 @@ def refresh_instagram_cache():
                         
                         # Cache the fresh posts
                         CacheManager.cache_posts_batch(user.id, media_list)
+                        events.publish(user.id, 'instagram_cache_refreshed', {'count': len(media_list)})
                         refreshed_count += 1
                         scheduler_app.logger.debug(f'Refreshed cache for user {user.id}')
                 except Exception as e:
@@ -4,11 +4,15 @@ Handles server-side caching with 30-day retention.
 """
 
 import os
-import requests
+import time
 from datetime import datetime, timedelta
 from models import db, InstagramCache, User
+from url_signing import sign_url
+from sqlalchemy import update
+from sqlalchemy.orm import load_only
 import logging
 from config import Config
+from instagram_api import http_session
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +21,9 @@ class CacheManager:
     
     CACHE_EXPIRY_DAYS = 30
     CACHE_IMAGE_FOLDER = 'cache/instagram_images'
+    IMAGE_URL_PREFIX = '/api/instagram/cache-image/'
+    IMAGE_URL_PURPOSE = 'cache-image'
+    IMAGE_URL_BUCKET_SECONDS = 86400  # Signed URLs stay identical for a day so browsers can cache them
     
     @staticmethod
     def ensure_cache_folder():
@@ -42,7 +49,7 @@ class CacheManager:
             filepath = os.path.join(CacheManager.CACHE_IMAGE_FOLDER, filename)
             
             # Download with timeout
-            response = requests.get(image_url, timeout=10, stream=True)
+            response = http_session.get(image_url, timeout=10, stream=True)
             response.raise_for_status()
             
             # Save image
@@ -128,20 +135,54 @@ class CacheManager:
         """
         Cache multiple Instagram posts.
         
+        Post metadata for the whole batch is written with one upsert and
+        committed before any images are downloaded, so slow downloads don't
+        hold the transaction open. Image paths are then saved in one bulk
+        UPDATE.
+        
         Args:
             user_id: ID of the user
             posts_data: List of post dictionaries
         
         Returns:
-            List of cached posts
+            List of cache row IDs
         """
-        cached_posts = []
+        posts_data = [post for post in posts_data if post.get('id')]
+        if not posts_data:
+            return []
+        
+        try:
+            cache_ids = InstagramCache.upsert(user_id, posts_data, CacheManager.CACHE_EXPIRY_DAYS)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to cache posts: {str(e)}", exc_info=True)
+            return []
+        
+        image_updates = []
         for post_data in posts_data:
-            cached = CacheManager.cache_post(user_id, post_data)
-            if cached:
-                cached_posts.append(cached)
+            image_url = post_data.get('media_url') or post_data.get('thumbnail_url')
+            if not image_url:
+                continue
+            cache_id = cache_ids[post_data['id']]
+            filepath = CacheManager.download_image(image_url, cache_id)
+            if filepath:
+                image_updates.append({
+                    'id': cache_id,
+                    'cached_image_path': filepath,
+                    'image_filename': os.path.basename(filepath)
+                })
         
-        return cached_posts
+        if image_updates:
+            try:
+                db.session.execute(update(InstagramCache), image_updates)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to save cached image paths: {str(e)}", exc_info=True)
+        
+        logger.info(f"Cached {len(cache_ids)} posts for user {user_id}")
+        return list(cache_ids.values())
     
     @staticmethod
     def get_cached_posts(user_id, limit=25):
@@ -168,16 +209,80 @@ class CacheManager:
     @staticmethod
     def get_cached_post(instagram_post_id):
         """Get a specific cached post"""
-        return InstagramCache.query.filter_by(
+        return InstagramCache.query.options(
+            load_only(InstagramCache.id, InstagramCache.cached_image_path, InstagramCache.image_filename)
+        ).filter_by(
             instagram_post_id=instagram_post_id
         ).first()
     
+    @staticmethod
+    def get_cached_posts_bulk(instagram_post_ids):
+        """
+        Get cached posts for several Instagram post IDs in one query.
+        
+        Only the columns needed to build image URLs are loaded.
+        
+        Returns:
+            Dict mapping instagram_post_id to InstagramCache
+        """
+        if not instagram_post_ids:
+            return {}
+        caches = InstagramCache.query.options(
+            load_only(
+                InstagramCache.id, InstagramCache.instagram_post_id,
+                InstagramCache.cached_image_path, InstagramCache.image_filename
+            )
+        ).filter(
+            InstagramCache.instagram_post_id.in_(instagram_post_ids)
+        ).all()
+        return {cache.instagram_post_id: cache for cache in caches}
+    
+    @staticmethod
+    def image_url_expiry():
+        """Expiry for new signed URLs: the next bucket boundary plus one bucket"""
+        bucket = CacheManager.IMAGE_URL_BUCKET_SECONDS
+        return (int(time.time()) // bucket + 2) * bucket
+    
+    @staticmethod
+    def signed_image_url(cache, expires=None):
+        """
+        Build a signed URL for a cached image.
+        
+        The URL carries everything needed to serve the file, so the image
+        endpoint doesn't have to look the cache row up again.
+        """
+        filename = cache.image_filename or os.path.basename(cache.cached_image_path)
+        if expires is None:
+            expires = CacheManager.image_url_expiry()
+        signature = sign_url(CacheManager.IMAGE_URL_PURPOSE, cache.id, filename, expires)
+        return ''.join((
+            CacheManager.IMAGE_URL_PREFIX, str(cache.id),
+            '?f=', filename, '&e=', str(expires), '&s=', signature
+        ))
+    
+    @staticmethod
+    def get_cached_image_urls(instagram_post_ids):
+        """
+        Get signed image URLs for the cached posts among instagram_post_ids.
+        
+        Returns:
+            Dict mapping instagram_post_id to URL, for posts with a cached image
+        """
+        caches = CacheManager.get_cached_posts_bulk(instagram_post_ids)
+        expires = CacheManager.image_url_expiry()
+        return {
+            post_id: CacheManager.signed_image_url(cache, expires)
+            for post_id, cache in caches.items() if cache.cached_image_path
+        }
+    
     @staticmethod
     def clear_expired_cache():
         """Delete all expired cache entries and their images"""
         try:
             now = datetime.utcnow()
-            expired_caches = InstagramCache.query.filter(
+            expired_caches = InstagramCache.query.options(
+                load_only(InstagramCache.id, InstagramCache.cached_image_path)
+            ).filter(
                 InstagramCache.expires_at <= now
             ).all()
             
@@ -208,7 +313,9 @@ class CacheManager:
     def invalidate_user_cache(user_id):
         """Invalidate (delete) all cache for a specific user"""
         try:
-            user_caches = InstagramCache.query.filter_by(user_id=user_id).all()
+            user_caches = InstagramCache.query.options(
+                load_only(InstagramCache.id, InstagramCache.cached_image_path)
+            ).filter_by(user_id=user_id).all()
             
             deleted_count = 0
             for cache in user_caches:
@@ -281,7 +388,7 @@ class CacheManager:
             filepath = os.path.join(CacheManager.CACHE_IMAGE_FOLDER, filename)
             
             # Download with timeout
-            response = requests.get(profile_picture_url, timeout=10, stream=True)
+            response = http_session.get(profile_picture_url, timeout=10, stream=True)
             response.raise_for_status()
             
             # Save image
@@ -12,6 +12,8 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///igscheduler.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Development/CI aid: make lazy relationship loads in requests raise
+    RAISE_ON_LAZY_LOAD = os.getenv('RAISE_ON_LAZY_LOAD', 'false').lower() == 'true'
     
     # JWT
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'dev-jwt-secret-key')
@@ -27,7 +29,9 @@ class Config:
     # Upload
     MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 52428800))  # 50MB
     UPLOAD_FOLDER = os.getenv('UPLOADS_PATH', './uploads')
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4'}
+    ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'mp4'})
+    # Let a fronting nginx/apache serve files via X-Sendfile
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
     
     # Server
     HOST = os.getenv('HOST', '0.0.0.0')
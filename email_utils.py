@@ -1,11 +1,14 @@
 """Email utilities for sending invitations and notifications."""
 
 import smtplib
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from config import Config
 import logging
 import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +24,12 @@ def get_app_url(default='http://localhost:5500'):
         The application URL
     """
     try:
-        from models import Settings
+        from settings_cache import get_setting
         # Try to get app_domain from settings
-        setting = Settings.query.filter_by(key='app_domain').first()
-        if setting and setting.value:
+        domain = get_setting('app_domain')
+        if domain:
             # Ensure it has a protocol
-            url = setting.value.strip()
+            url = domain.strip()
             if not url.startswith('http://') and not url.startswith('https://'):
                 url = f'https://{url}'
             return url
@@ -54,23 +57,17 @@ def get_mail_config(key, default=None):
     """
     try:
         # Try to import and use database settings
-        from models import Settings
-        # Try both lowercase and uppercase versions
-        setting = Settings.query.filter_by(key=key).first()
-        if not setting:
-            # Try lowercase version
-            setting = Settings.query.filter_by(key=key.lower()).first()
-        if not setting:
-            # Try uppercase version
-            setting = Settings.query.filter_by(key=key.upper()).first()
-            
-        if setting and setting.value:
+        from settings_cache import get_email_settings_map
+        # Same lowercase-first precedence as the settings endpoints
+        value = get_email_settings_map().get(key.lower())
+        
+        if value:
             # Convert string values to appropriate types
             if 'port' in key.lower():
-                return int(setting.value)
+                return int(value)
             elif 'tls' in key.lower():
-                return setting.value.lower() in ('true', '1', 'yes')
-            return setting.value
+                return value.lower() in ('true', '1', 'yes')
+            return value
     except Exception as e:
         logger.debug(f'Could not load {key} from database: {e}')
     
@@ -90,6 +87,93 @@ def get_mail_config(key, default=None):
     return default
 
 
+class SMTPPool:
+    """
+    Keeps logged-in SMTP connections open between sends.
+    
+    Connections are keyed by the full server and credential config, so
+    changing settings never reuses a session opened with old values. Any
+    error while a connection is checked out discards it.
+    """
+    
+    MAX_IDLE = 2  # Idle connections kept per config
+    IDLE_TIMEOUT = 60  # Seconds; servers drop idle sessions after a few minutes
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+    
+    @staticmethod
+    def _connect(server, port, use_tls, username, password, timeout):
+        smtp = smtplib.SMTP(server, port, timeout=timeout)
+        try:
+            if use_tls:
+                smtp.starttls()
+            if username and password:
+                smtp.login(username, password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+    
+    @staticmethod
+    def _discard(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+    
+    @contextmanager
+    def acquire(self, server, port, use_tls=True, username=None, password=None, timeout=30, reuse=True):
+        """Check out a connection for the given config, opening one if none is idle"""
+        key = (server, port, use_tls, username, password)
+        smtp = None
+        
+        if reuse:
+            now = time.monotonic()
+            with self._lock:
+                idle = self._idle.get(key, [])
+                while idle and smtp is None:
+                    conn, last_used = idle.pop()
+                    if now - last_used < self.IDLE_TIMEOUT:
+                        smtp = conn
+                    else:
+                        self._discard(conn)
+        
+        if smtp is None:
+            smtp = self._connect(server, port, use_tls, username, password, timeout)
+        
+        try:
+            yield smtp
+        except Exception:
+            self._discard(smtp)
+            raise
+        
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append((smtp, time.monotonic()))
+                smtp = None
+        if smtp is not None:
+            self._discard(smtp)
+    
+    def send_message(self, msg, **config):
+        """Send a message, retrying once on a fresh connection if a pooled one went stale"""
+        try:
+            with self.acquire(**config) as smtp:
+                smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            with self.acquire(reuse=False, **config) as smtp:
+                smtp.send_message(msg)
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code != 421:
+                raise
+            with self.acquire(reuse=False, **config) as smtp:
+                smtp.send_message(msg)
+
+
+smtp_pool = SMTPPool()
+
 
 class EmailService:
     """Service for sending emails via SMTP"""
@@ -133,15 +217,15 @@ class EmailService:
                 msg.attach(MIMEText(text_content, 'plain'))
             msg.attach(MIMEText(html_content, 'html'))
             
-            # Send email
-            with smtplib.SMTP(mail_server, mail_port) as server:
-                if mail_use_tls:
-                    server.starttls()
-                
-                if mail_username and mail_password:
-                    server.login(mail_username, mail_password)
-                
-                server.send_message(msg)
+            # Send email over a pooled connection
+            smtp_pool.send_message(
+                msg,
+                server=mail_server,
+                port=mail_port,
+                use_tls=mail_use_tls,
+                username=mail_username,
+                password=mail_password
+            )
             
             logger.info(f'Email sent successfully to {to_email}')
             return True, 'Email sent successfully'
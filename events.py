@@ -0,0 +1,90 @@
+"""
+In-process publish/subscribe for server-sent events.
+
+Background jobs publish small notifications (cache refreshed, post published)
+for a user, and every open /api/instagram/events stream of that user receives
+them. Clients re-fetch data only when told something changed instead of
+polling on a timer.
+"""
+
+import json
+import queue
+import threading
+import time
+
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+MAX_STREAMS_PER_USER = 5
+# Each stream holds a server thread; clients reconnect after this
+STREAM_MAX_SECONDS = 600
+
+_lock = threading.Lock()
+_subscribers = {}  # user_id -> set of queues
+
+
+def subscribe(user_id):
+    """
+    Register a new listener for a user and return its queue, or None when
+    the user already has MAX_STREAMS_PER_USER open streams.
+    """
+    q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    with _lock:
+        listeners = _subscribers.setdefault(user_id, set())
+        if len(listeners) >= MAX_STREAMS_PER_USER:
+            return None
+        listeners.add(q)
+    return q
+
+
+def unsubscribe(user_id, q):
+    """Remove a listener registered with subscribe()"""
+    with _lock:
+        listeners = _subscribers.get(user_id)
+        if listeners:
+            listeners.discard(q)
+            if not listeners:
+                del _subscribers[user_id]
+
+
+def publish(user_id, event, data=None):
+    """Send an event to every listener of a user. Never blocks."""
+    with _lock:
+        listeners = list(_subscribers.get(user_id, ()))
+    for q in listeners:
+        try:
+            q.put_nowait((event, data))
+        except queue.Full:
+            # A stalled client shouldn't hold up the publisher
+            pass
+
+
+def stream(user_id):
+    """
+    Subscribe a user and yield text/event-stream chunks until the client goes
+    away or the stream has been open for STREAM_MAX_SECONDS.
+    
+    The subscription is made on the first chunk, so a response whose body is
+    never read leaves nothing registered. Over MAX_STREAMS_PER_USER, a single
+    stream_limit event is sent and the stream ends.
+    """
+    q = subscribe(user_id)
+    if q is None:
+        yield 'event: stream_limit\ndata: {}\n\n'
+        return
+    
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    try:
+        yield ': connected\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event, data = q.get(timeout=min(KEEPALIVE_SECONDS, remaining))
+            except queue.Empty:
+                # Comment lines keep proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+            yield f'event: {event}\ndata: {json.dumps(data or {})}\n\n'
+    finally:
+        unsubscribe(user_id, q)
@@ -1,12 +1,61 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 from config import Config
 import logging
+import threading
 import time
 
 logger = logging.getLogger(__name__)
 
+
+def create_http_session():
+    """Create a requests session that keeps connections to the Graph API and CDN alive"""
+    session = requests.Session()
+    # Retry transient gateway errors and dropped connections on GETs only;
+    # POSTs create or publish media and must not be repeated blindly
+    retry = Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Shared by every InstagramAPI instance so TLS handshakes are paid once per
+# host rather than once per call
+http_session = create_http_session()
+
+# Account info from status checks, keyed by (account ID, access token) so a
+# reconnect with a new token is never answered from the old entry
+ACCOUNT_INFO_TTL = 300  # seconds
+ACCOUNT_INFO_MAX_ENTRIES = 1000
+_account_info_cache = {}
+_account_info_lock = threading.Lock()
+
+# Every Graph POST carries an explicit timeout so a hung request can't hold a
+# publish claim open indefinitely
+GRAPH_POST_TIMEOUT = 30  # seconds
+PUBLISH_MAX_RETRIES = 10
+PUBLISH_RETRY_MAX_WAIT = 30  # seconds
+MAX_CAROUSEL_ITEMS = 10
+
+# Longest a single publish_post call can take: one container per carousel
+# item, the carousel container, then every media_publish attempt and the
+# backoff sleeps between them
+PUBLISH_MAX_SECONDS = (
+    (MAX_CAROUSEL_ITEMS + 1 + PUBLISH_MAX_RETRIES) * GRAPH_POST_TIMEOUT
+    + sum(min(2 ** attempt, PUBLISH_RETRY_MAX_WAIT) for attempt in range(PUBLISH_MAX_RETRIES - 1))
+)
+
+
 class InstagramAPI:
     """
     Instagram Graph API integration for Business accounts.
@@ -17,11 +66,15 @@ class InstagramAPI:
     3. Facebook App with Instagram Graph API permissions (optional)
     """
     
+    # Fields returned for an Instagram Business Account
+    ACCOUNT_FIELDS = 'username,profile_picture_url,followers_count,media_count'
+    
     def __init__(self, app_id=None, app_secret=None):
         self.base_url = Config.INSTAGRAM_GRAPH_URL
         # Use provided credentials, fall back to config, then empty strings
         self.app_id = app_id or Config.INSTAGRAM_APP_ID or ''
         self.app_secret = app_secret or Config.INSTAGRAM_APP_SECRET or ''
+        self.session = http_session
     
     def get_long_lived_token(self, short_lived_token):
         """
@@ -47,7 +100,7 @@ class InstagramAPI:
         }
         
         logger.debug(f'Requesting long-lived token from {url}')
-        response = requests.get(url, params=params)
+        response = self.session.get(url, params=params)
         
         if response.status_code == 200:
             data = response.json()
@@ -65,7 +118,18 @@ class InstagramAPI:
     def get_instagram_account_id_from_token(self, access_token):
         """
         Get Instagram Business Account ID directly from access token.
+        """
+        return self.find_instagram_account(access_token)['id']
+    
+    def find_instagram_account(self, access_token):
+        """
+        Find the Instagram Business Account for an access token.
         Tries multiple approaches to find the Instagram Business Account.
+        
+        Returns:
+            Account dict with 'id'. When found through a Facebook Page the
+            account fields are expanded into the same response, so the dict
+            also holds username, profile_picture_url, etc.
         """
         logger.info('Attempting to auto-detect Instagram Business Account ID from token')
         
@@ -73,12 +137,12 @@ class InstagramAPI:
         try:
             url = f"{self.base_url}/me/accounts"
             params = {
-                'fields': 'id,name,instagram_business_account',
+                'fields': f'id,name,instagram_business_account{{id,{self.ACCOUNT_FIELDS}}}',
                 'access_token': access_token
             }
             
             logger.debug(f'Approach 1: GET {url}')
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params)
             logger.debug(f'Approach 1 response: {response.status_code}')
             
             if response.status_code == 200:
@@ -93,7 +157,7 @@ class InstagramAPI:
                     
                     if ig_id:
                         logger.info(f'Approach 1 SUCCESS: Found Instagram Business Account: {ig_id}')
-                        return ig_id
+                        return ig_account
                 logger.debug('Approach 1: No Instagram Business Account found in pages')
             else:
                 logger.warning(f'Approach 1 failed: {response.status_code} - {response.text}')
@@ -108,7 +172,7 @@ class InstagramAPI:
             }
             
             logger.debug(f'Approach 2: GET {url}')
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params)
             logger.debug(f'Approach 2 response: {response.status_code}')
             
             if response.status_code == 200:
@@ -119,7 +183,7 @@ class InstagramAPI:
                 if accounts and len(accounts) > 0:
                     ig_id = accounts[0].get('id')
                     logger.info(f'Approach 2 SUCCESS: Found Instagram Business Account: {ig_id}')
-                    return ig_id
+                    return {'id': ig_id}
             else:
                 logger.warning(f'Approach 2 failed: {response.status_code} - {response.text}')
         except Exception as e:
@@ -146,7 +210,7 @@ class InstagramAPI:
         }
         
         logger.debug(f'Fetching Instagram Business Account for page {page_id}')
-        response = requests.get(url, params=params)
+        response = self.session.get(url, params=params)
         
         if response.status_code == 200:
             data = response.json()
@@ -160,6 +224,39 @@ class InstagramAPI:
             error_msg = f"Failed to get Instagram account: {response.status_code} - {response.text}"
             logger.error(error_msg)
             raise Exception(error_msg)
+    
+    def get_page_instagram_account(self, page_id, access_token):
+        """
+        Get the Instagram Business Account linked to a Facebook Page.
+        
+        Uses field expansion so the account ID and account info come back in
+        a single Graph API call.
+        
+        Returns:
+            Account dict with 'id' and the account fields, or an empty dict if
+            the page has no linked Instagram account
+        """
+        url = f"{self.base_url}/{page_id}"
+        params = {
+            'fields': f'instagram_business_account{{id,{self.ACCOUNT_FIELDS}}}',
+            'access_token': access_token
+        }
+        
+        logger.debug(f'Fetching Instagram Business Account with account info for page {page_id}')
+        response = self.session.get(url, params=params)
+        
+        if response.status_code == 200:
+            account = response.json().get('instagram_business_account') or {}
+            if account.get('id'):
+                logger.info(f"Found Instagram Business Account: {account['id']}")
+            else:
+                logger.warning(f'No instagram_business_account for page {page_id}')
+            return account
+        else:
+            error_msg = f"Failed to get Instagram account: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+    
     def validate_token(self, access_token):
         """
         Validate the access token and return token info.
@@ -172,7 +269,7 @@ class InstagramAPI:
         }
         
         try:
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params)
             if response.status_code == 200:
                 data = response.json()
                 token_info = data.get('data', {})
@@ -191,12 +288,12 @@ class InstagramAPI:
         """
         url = f"{self.base_url}/{ig_account_id}"
         params = {
-            'fields': 'username,profile_picture_url,followers_count,media_count',
+            'fields': self.ACCOUNT_FIELDS,
             'access_token': access_token
         }
         
         logger.debug(f'Fetching account info for {ig_account_id}')
-        response = requests.get(url, params=params)
+        response = self.session.get(url, params=params)
         
         if response.status_code == 200:
             logger.info(f'Successfully retrieved account info')
@@ -211,6 +308,35 @@ class InstagramAPI:
                 raise Exception(f"{error_msg}\n\nToken Type: {token_type} (Need Page or App token with instagram_business_account permission)\nMake sure your Instagram Business Account is connected to a Facebook Page.")
             raise Exception(error_msg)
     
+    def get_account_info_cached(self, ig_account_id, access_token):
+        """
+        Get account info, reusing a successful response for ACCOUNT_INFO_TTL seconds.
+        Failures are not cached, so a broken token is reported on the next call.
+        """
+        key = (ig_account_id, access_token)
+        now = time.monotonic()
+        with _account_info_lock:
+            entry = _account_info_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        
+        account_info = self.get_account_info(ig_account_id, access_token)
+        with _account_info_lock:
+            # Token rotation leaves old keys behind; drop expired ones as we go
+            for stale in [k for k, (expires, _) in _account_info_cache.items() if expires <= now]:
+                del _account_info_cache[stale]
+            if len(_account_info_cache) >= ACCOUNT_INFO_MAX_ENTRIES:
+                # Still full of live entries: evict the one closest to expiry
+                del _account_info_cache[min(_account_info_cache, key=lambda k: _account_info_cache[k][0])]
+            _account_info_cache[key] = (now + ACCOUNT_INFO_TTL, account_info)
+        return account_info
+    
+    @staticmethod
+    def invalidate_account_info(ig_account_id):
+        """Drop cached account info for an account (e.g. on disconnect)"""
+        with _account_info_lock:
+            for key in [k for k in _account_info_cache if k[0] == ig_account_id]:
+                del _account_info_cache[key]
     
     def get_media_list(self, access_token, ig_account_id, limit=25):
         """
@@ -224,7 +350,7 @@ class InstagramAPI:
         }
         
         logger.debug(f'Fetching media list for {ig_account_id}')
-        response = requests.get(url, params=params)
+        response = self.session.get(url, params=params)
         
         if response.status_code == 200:
             data = response.json()
@@ -301,7 +427,7 @@ class InstagramAPI:
                 params['caption'] = caption
         
         logger.debug(f'Creating media container with URL: {image_url}')
-        response = requests.post(url, params=params)
+        response = self.session.post(url, params=params, timeout=GRAPH_POST_TIMEOUT)
         
         if response.status_code == 200:
             logger.info(f'Successfully created media container')
@@ -326,7 +452,7 @@ class InstagramAPI:
         if caption:
             params['caption'] = caption
         
-        response = requests.post(url, params=params)
+        response = self.session.post(url, params=params, timeout=GRAPH_POST_TIMEOUT)
         if response.status_code == 200:
             return response.json().get('id')
         else:
@@ -340,14 +466,14 @@ class InstagramAPI:
         """
         url = f"{self.base_url}/{ig_account_id}/media_publish"
         
-        max_retries = 10
+        max_retries = PUBLISH_MAX_RETRIES
         for attempt in range(max_retries):
             params = {
                 'creation_id': container_id,
                 'access_token': access_token
             }
             
-            response = requests.post(url, params=params)
+            response = self.session.post(url, params=params, timeout=GRAPH_POST_TIMEOUT)
             
             if response.status_code == 200:
                 return response.json().get('id')
@@ -357,7 +483,7 @@ class InstagramAPI:
             
             # Error 9007 means "Media ID is not available" - need to wait and retry
             if error_code == 9007 and attempt < max_retries - 1:
-                wait_time = min(2 ** attempt, 30)  # Exponential backoff, max 30 seconds
+                wait_time = min(2 ** attempt, PUBLISH_RETRY_MAX_WAIT)  # Exponential backoff
                 logger.warning(f"Media not ready yet, retrying in {wait_time}s (attempt {attempt + 1}/{max_retries})")
                 time.sleep(wait_time)
                 continue
@@ -378,8 +504,8 @@ class InstagramAPI:
                 )
             else:
                 # Carousel post (2-10 images)
-                if len(media_urls) > 10:
-                    raise Exception("Maximum 10 images allowed in a carousel")
+                if len(media_urls) > MAX_CAROUSEL_ITEMS:
+                    raise Exception(f"Maximum {MAX_CAROUSEL_ITEMS} images allowed in a carousel")
                 
                 # Create containers for each image
                 children_ids = []
@@ -400,3 +526,8 @@ class InstagramAPI:
         
         except Exception as e:
             raise Exception(f"Failed to publish post: {str(e)}")
+
+
+# Shared instance for the app-level credentials. Teams with their own app
+# credentials still construct InstagramAPI(app_id=..., app_secret=...).
+shared_api = InstagramAPI()
@@ -0,0 +1,46 @@
+"""
+orjson-backed JSON provider for Flask.
+
+jsonify() and request.get_json() go through app.json, so installing this
+provider moves all API encoding and decoding onto orjson's C implementation.
+"""
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson"""
+
+    def _options(self, sort_keys, indent):
+        """Build the orjson option flags for the given formatting"""
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a JSON string"""
+        option = self._options(kwargs.get('sort_keys', self.sort_keys), kwargs.get('indent'))
+        # Types orjson doesn't know (Decimal, date-like objects, ...) fall back
+        # to Flask's default handling
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserialize JSON from a string or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """
+        Build a JSON response for jsonify().
+
+        orjson's bytes go straight into the response body instead of being
+        decoded to str and encoded again.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        option = self._options(self.sort_keys, indent) | orjson.OPT_APPEND_NEWLINE
+        body = orjson.dumps(obj, default=self.default, option=option)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -1,11 +1,68 @@
-from datetime import datetime
+import logging
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, and_, event, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session, raiseload
 from werkzeug.security import generate_password_hash, check_password_hash
+from instagram_api import PUBLISH_MAX_SECONDS
 
 db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+# Trigram indexes back the unanchored ILIKE searches on Postgres
+event.listen(
+    db.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+
+# Password hashing is CPU-bound by design and runs on the request thread.
+# Capping how many hashes run at once to the CPU count stops a burst of
+# logins from oversubscribing the machine and starving other request threads.
+PASSWORD_HASH_CONCURRENCY = os.cpu_count() or 2
+_password_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_CONCURRENCY)
+
+# A publish attempt that hasn't finished after this long is assumed dead.
+# Kept at twice the worst case of a live publish so a slow one is never
+# taken over and sent to Instagram a second time.
+PUBLISH_CLAIM_TTL = 2 * PUBLISH_MAX_SECONDS  # seconds
+
+
+def hash_password(password):
+    """Hash a password for storage in users.password_hash. Blocks the caller while it waits for a hashing slot."""
+    # Hashing is deliberately slow; skip it when running the test suite
+    if current_app.config.get('TESTING'):
+        return f'plain:{password}'
+    with _password_hash_slots:
+        return generate_password_hash(password)
+
+
+def verify_password(password_hash, password):
+    """Check a password against a stored hash without needing a User instance."""
+    if password_hash.startswith('plain:'):
+        return bool(current_app.config.get('TESTING')) and password_hash == f'plain:{password}'
+    with _password_hash_slots:
+        return check_password_hash(password_hash, password)
+
+
+def trigram_index(name, column):
+    """GIN trigram index for ILIKE '%...%' lookups, only emitted on Postgres"""
+    return db.Index(
+        name, column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}
+    ).ddl_if(dialect='postgresql')
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),  # Keyset pagination
+        trigram_index('ix_users_name_trgm', 'name'),
+        trigram_index('ix_users_email_trgm', 'email'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
@@ -21,24 +78,42 @@ class User(db.Model):
     instagram_username = db.Column(db.String(255), nullable=True)
     instagram_profile_picture = db.Column(db.Text, nullable=True)  # Cached profile picture URL
     token_expires_at = db.Column(db.DateTime, nullable=True)
+    instagram_connected = db.Column(db.Boolean, default=False, nullable=False, index=True)  # Kept in sync with instagram_account_id
+    dashboard_version = db.Column(db.Integer, default=0, nullable=False)  # Bumped whenever the user's posts change
     
     # Relationships
     posts = db.relationship('Post', backref='user', lazy=True, cascade='all, delete-orphan')
     
+    @classmethod
+    def bump_dashboard_version(cls, user_id):
+        """
+        Increment a user's dashboard version in the current transaction.
+        
+        Returns:
+            The new version number
+        """
+        return db.session.execute(
+            update(cls)
+            .where(cls.id == user_id)
+            .values(dashboard_version=cls.dashboard_version + 1)
+            .returning(cls.dashboard_version)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+    
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
     
     def to_dict(self):
         return {
             'id': self.id,
             'email': self.email,
             'name': self.name,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at,
             'is_super_admin': self.is_super_admin,
-            'instagram_connected': bool(self.instagram_account_id),
+            'instagram_connected': self.instagram_connected,
             'instagram_username': self.instagram_username,
             'profile_picture': self.instagram_profile_picture
         }
@@ -46,6 +121,10 @@ class User(db.Model):
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_user_status_scheduled', 'user_id', 'status', 'scheduled_time'),  # Post lists and upcoming posts
+        db.Index('ix_posts_team_created', 'team_id', 'created_at'),  # Team post lists
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -62,6 +141,7 @@ class Post(db.Model):
     instagram_post_id = db.Column(db.String(255), nullable=True)
     error_message = db.Column(db.Text, nullable=True)
     published_at = db.Column(db.DateTime, nullable=True)
+    publish_claimed_at = db.Column(db.DateTime, nullable=True)  # When the current publish attempt started
     
     # Metadata
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -70,19 +150,49 @@ class Post(db.Model):
     # Relationships
     media = db.relationship('Media', backref='post', lazy=True, cascade='all, delete-orphan', order_by='Media.order')
     
+    @classmethod
+    def claim_for_publishing(cls, post_id, statuses=None):
+        """
+        Move a post to 'publishing' in the current transaction, unless
+        another attempt holds it.
+        
+        A claim older than PUBLISH_CLAIM_TTL is treated as abandoned (the
+        worker crashed or was shut down) and can be taken over.
+        
+        Args:
+            statuses: Only claim posts in one of these statuses; by default
+                any post that isn't published or being published
+        
+        Returns:
+            True if this call claimed the post
+        """
+        now = datetime.utcnow()
+        claimable = cls.status.in_(statuses) if statuses else cls.status.notin_(['publishing', 'published'])
+        stale = and_(
+            cls.status == 'publishing',
+            or_(cls.publish_claimed_at.is_(None), cls.publish_claimed_at < now - timedelta(seconds=PUBLISH_CLAIM_TTL))
+        )
+        return db.session.execute(
+            update(cls)
+            .where(cls.id == post_id, or_(claimable, stale))
+            .values(status='publishing', publish_claimed_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+    
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'team_id': self.team_id,
             'caption': self.caption,
-            'scheduled_time': self.scheduled_time.isoformat(),
+            # Datetimes are left to the JSON provider; orjson writes them as ISO 8601
+            'scheduled_time': self.scheduled_time,
             'status': self.status,
             'instagram_post_id': self.instagram_post_id,
             'error_message': self.error_message,
-            'published_at': self.published_at.isoformat() if self.published_at else None,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat(),
+            'published_at': self.published_at,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
             'media': [m.to_dict() for m in self.media]
         }
 
@@ -113,12 +223,15 @@ class Media(db.Model):
             'filepath': self.filepath,
             'media_type': self.media_type,
             'order': self.order,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at
         }
 
 
 class InstagramCache(db.Model):
     __tablename__ = 'instagram_cache'
+    __table_args__ = (
+        db.Index('ix_instagram_cache_user_expires', 'user_id', 'expires_at'),  # Per-user valid-cache lookups and stats
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -142,8 +255,8 @@ class InstagramCache(db.Model):
             'id': self.id,
             'instagram_post_id': self.instagram_post_id,
             'post_data': self.post_data,
-            'created_at': self.created_at.isoformat(),
-            'expires_at': self.expires_at.isoformat(),
+            'created_at': self.created_at,
+            'expires_at': self.expires_at,
             'is_expired': datetime.utcnow() > self.expires_at
         }
         
@@ -156,10 +269,82 @@ class InstagramCache(db.Model):
     def is_valid(self):
         """Check if cache is still valid"""
         return datetime.utcnow() <= self.expires_at
+    
+    @classmethod
+    def upsert(cls, user_id, posts_data, expiry_days):
+        """
+        Write post metadata for many posts in one INSERT ... ON CONFLICT
+        (instagram_post_id) statement.
+        
+        Existing rows get fresh post_data and expiry; image columns are left
+        alone. Runs inside the current session transaction; the caller commits.
+        
+        Args:
+            user_id: Owner of new cache rows
+            posts_data: List of post dicts with an 'id'
+            expiry_days: Days until the rows expire
+        
+        Returns:
+            Dict mapping instagram_post_id to cache row ID
+        """
+        if not posts_data:
+            return {}
+        
+        now = datetime.utcnow()
+        expires_at = now + timedelta(days=expiry_days)
+        values = [
+            {
+                'user_id': user_id,
+                'instagram_post_id': post['id'],
+                'post_data': post,
+                'created_at': now,
+                'updated_at': now,
+                'expires_at': expires_at
+            }
+            for post in posts_data
+        ]
+        
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            # No portable upsert; fall back to the ORM
+            existing = {
+                c.instagram_post_id: c
+                for c in cls.query.filter(cls.instagram_post_id.in_([v['instagram_post_id'] for v in values])).all()
+            }
+            for v in values:
+                cache = existing.get(v['instagram_post_id'])
+                if cache is None:
+                    cache = existing[v['instagram_post_id']] = cls(**v)
+                    db.session.add(cache)
+                else:
+                    cache.post_data = v['post_data']
+                    cache.updated_at = now
+                    cache.expires_at = expires_at
+            db.session.flush()
+            return {post_id: cache.id for post_id, cache in existing.items()}
+        
+        stmt = insert(cls).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.instagram_post_id],
+            set_={
+                'post_data': stmt.excluded.post_data,
+                'updated_at': now,
+                'expires_at': expires_at
+            }
+        )
+        return {row.instagram_post_id: row.id for row in db.session.execute(stmt.returning(cls.id, cls.instagram_post_id))}
 
 
 class Team(db.Model):
     __tablename__ = 'teams'
+    __table_args__ = (
+        db.Index('ix_teams_created_at_id', 'created_at', 'id'),  # Keyset pagination
+        trigram_index('ix_teams_name_trgm', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -173,6 +358,7 @@ class Team(db.Model):
     instagram_username = db.Column(db.String(255), nullable=True)
     instagram_profile_picture = db.Column(db.Text, nullable=True)
     token_expires_at = db.Column(db.DateTime, nullable=True)
+    instagram_connected = db.Column(db.Boolean, default=False, nullable=False, index=True)  # Kept in sync with instagram_account_id
     
     # Optional: Team-specific Instagram App credentials for token exchange
     instagram_app_id = db.Column(db.String(255), nullable=True)
@@ -188,9 +374,9 @@ class Team(db.Model):
             'name': self.name,
             'description': self.description,
             'created_by': self.created_by,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at,
             'instagram_username': self.instagram_username,
-            'instagram_connected': bool(self.instagram_account_id)
+            'instagram_connected': self.instagram_connected
         }
         if include_members:
             data['members'] = [m.to_dict() for m in self.members]
@@ -200,6 +386,11 @@ class Team(db.Model):
 class TeamMember(db.Model):
     __tablename__ = 'team_members'
     
+    __table_args__ = (
+        db.Index('ix_team_members_team_user', 'team_id', 'user_id', unique=True),  # One membership per user per team
+        db.Index('ix_team_members_user', 'user_id'),  # "Which teams am I in" lookups
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('teams.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -227,7 +418,7 @@ class TeamMember(db.Model):
             'can_schedule': self.can_schedule,
             'can_draft': self.can_draft,
             'requires_approval': self.requires_approval,
-            'joined_at': self.joined_at.isoformat()
+            'joined_at': self.joined_at
         }
 
 
@@ -261,8 +452,8 @@ class Invitation(db.Model):
             'team_id': self.team_id,
             'role': self.role,
             'status': self.status,
-            'created_at': self.created_at.isoformat(),
-            'expires_at': self.expires_at.isoformat()
+            'created_at': self.created_at,
+            'expires_at': self.expires_at
         }
 
 
@@ -296,8 +487,8 @@ class PostApproval(db.Model):
             'status': self.status,
             'reviewed_by': self.reviewed_by,
             'review_comments': self.review_comments,
-            'created_at': self.created_at.isoformat(),
-            'reviewed_at': self.reviewed_at.isoformat() if self.reviewed_at else None
+            'created_at': self.created_at,
+            'reviewed_at': self.reviewed_at
         }
 
 
@@ -321,19 +512,91 @@ class Settings(db.Model):
             'description': self.description,
             'editable': self.editable
         }
+    
+    @classmethod
+    def upsert(cls, rows, update=True):
+        """
+        Write settings in one INSERT ... ON CONFLICT (key) statement.
+        
+        Existing keys get their value replaced, or are left alone when update
+        is False. Rows whose stored value already matches are not rewritten.
+        Runs inside the current session transaction; the caller
+        commits. Core statements skip ORM events, so callers also invalidate
+        the settings cache.
+        
+        Args:
+            rows: List of dicts with 'key' and 'value', optionally
+                'setting_type' and 'description'
+            update: Whether to overwrite values of existing keys
+        
+        Returns:
+            List of keys that were inserted or changed
+        """
+        if not rows:
+            return []
+        
+        now = datetime.utcnow()
+        values = [
+            {
+                'key': row['key'],
+                'value': row['value'],
+                'setting_type': row.get('setting_type', 'string'),
+                'description': row.get('description'),
+                'editable': row.get('editable', True),
+                'created_at': now,
+                'updated_at': now
+            }
+            for row in rows
+        ]
+        
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            # No portable upsert; fall back to the ORM
+            written = []
+            existing = {s.key: s for s in cls.query.filter(cls.key.in_([v['key'] for v in values])).all()}
+            for v in values:
+                setting = existing.get(v['key'])
+                if setting is None:
+                    db.session.add(cls(**v))
+                elif update and setting.value != v['value']:
+                    setting.value = v['value']
+                else:
+                    continue
+                written.append(v['key'])
+            return written
+        
+        stmt = insert(cls).values(values)
+        if update:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.key],
+                set_={'value': stmt.excluded.value, 'updated_at': now},
+                # Resubmitting an unchanged form doesn't touch the row
+                where=cls.value.is_distinct_from(stmt.excluded.value)
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[cls.key])
+        return list(db.session.execute(stmt.returning(cls.key)).scalars())
 
 
 class ActivityLog(db.Model):
     __tablename__ = 'activity_logs'
+    __table_args__ = (
+        # GIN index for containment / key lookups on extra_data (Postgres only)
+        db.Index('ix_activity_extra_gin', 'extra_data', postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('teams.id'), nullable=True)  # None for admin logs
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # Who performed the action
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Who performed the action; None once they're deleted
     action_type = db.Column(db.String(50), nullable=False)  # api_call, member_added, config_changed, post_scheduled, post_edited, post_deleted
     description = db.Column(db.Text, nullable=False)
     resource_type = db.Column(db.String(50), nullable=True)  # team, user, post, settings, etc.
     resource_id = db.Column(db.Integer, nullable=True)  # ID of affected resource
-    extra_data = db.Column(db.JSON, nullable=True)  # Additional details (old_value, new_value, etc.)
+    extra_data = db.Column(db.JSON().with_variant(JSONB(), 'postgresql'), nullable=True)  # Additional details (old_value, new_value, etc.)
     ip_address = db.Column(db.String(45), nullable=True)  # IPv4 or IPv6
     user_agent = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
@@ -353,5 +616,167 @@ class ActivityLog(db.Model):
             'resource_id': self.resource_id,
             'extra_data': self.extra_data,
             'ip_address': self.ip_address,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at
         }
+    
+    @classmethod
+    def feed(cls, *criteria, page=1, per_page=50):
+        """
+        Newest-first page of log entries matching the given criteria.
+        
+        Selects plain columns instead of ORM objects, which avoids the identity
+        map and lazy user loads on large listings. Rows match to_dict().
+        
+        Returns:
+            Tuple of (list of dicts, total count, page count)
+        """
+        page = max(page, 1)
+        per_page = per_page if per_page > 0 else 20
+        
+        total = db.session.scalar(
+            select(func.count(cls.id)).where(*criteria)
+        )
+        stmt = select(
+            cls.id, cls.team_id, cls.user_id, User.name, cls.action_type,
+            cls.description, cls.resource_type, cls.resource_id, cls.extra_data,
+            cls.ip_address, cls.created_at
+        ).outerjoin(
+            User, User.id == cls.user_id
+        ).where(*criteria).order_by(
+            cls.created_at.desc()
+        ).limit(per_page).offset((page - 1) * per_page)
+        
+        logs = [
+            {
+                'id': row[0],
+                'team_id': row[1],
+                'user_id': row[2],
+                'user_name': row[3] or 'Unknown',
+                'action_type': row[4],
+                'description': row[5],
+                'resource_type': row[6],
+                'resource_id': row[7],
+                'extra_data': row[8],
+                'ip_address': row[9],
+                'created_at': row[10]
+            }
+            for row in db.session.execute(stmt)
+        ]
+        pages = math.ceil(total / per_page) if total else 0
+        return logs, total, pages
+
+
+@event.listens_for(User.instagram_account_id, 'set')
+@event.listens_for(Team.instagram_account_id, 'set')
+def _sync_instagram_connected(target, value, oldvalue, initiator):
+    """Keep the stored instagram_connected flag in step with the account ID."""
+    target.instagram_connected = bool(value)
+
+
+def _raiseload_in_requests(orm_execute_state):
+    """Add raiseload('*') to top-level ORM selects issued while handling a request"""
+    if (
+        has_request_context()
+        and orm_execute_state.is_select
+        and not orm_execute_state.is_relationship_load
+        and not orm_execute_state.is_column_load
+    ):
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload('*'))
+
+
+def enable_raise_on_lazy_load():
+    """
+    Make relationship lazy loads inside request handlers raise instead of
+    querying, so N+1 patterns show up as errors in development and CI.
+    Relationships loaded with explicit eager options are unaffected.
+    """
+    if not event.contains(Session, 'do_orm_execute', _raiseload_in_requests):
+        event.listen(Session, 'do_orm_execute', _raiseload_in_requests)
+
+# Columns added after the initial release. db.create_all() only creates
+# missing tables, so existing databases get these via upgrade_schema().
+# Each entry: (table, column, column DDL, backfill SQL or None)
+SCHEMA_UPGRADES = [
+    ('users', 'instagram_connected', 'BOOLEAN NOT NULL DEFAULT FALSE',
+     'UPDATE users SET instagram_connected = (instagram_account_id IS NOT NULL)'),
+    ('teams', 'instagram_connected', 'BOOLEAN NOT NULL DEFAULT FALSE',
+     'UPDATE teams SET instagram_connected = (instagram_account_id IS NOT NULL)'),
+    ('users', 'dashboard_version', 'INTEGER NOT NULL DEFAULT 0', None),
+    ('posts', 'publish_claimed_at', 'TIMESTAMP', None),
+]
+
+# (table, column) pairs that older databases created as NOT NULL
+NULLABLE_COLUMNS = [
+    ('activity_logs', 'user_id'),
+]
+
+
+def rebuild_sqlite_table(table):
+    """
+    Recreate a SQLite table from its model, keeping its rows.
+    
+    SQLite can't change a column's constraints in place.
+    """
+    model_table = db.metadata.tables[table]
+    with db.engine.begin() as conn:
+        inspector = db.inspect(conn)
+        existing = {c['name'] for c in inspector.get_columns(table)}
+        columns = ', '.join(f'"{c.name}"' for c in model_table.columns if c.name in existing)
+        # Index names are global in SQLite; the model's indexes are created with the new table
+        for index in inspector.get_indexes(table):
+            conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+        conn.execute(text(f'ALTER TABLE {table} RENAME TO {table}_old'))
+        model_table.create(conn)
+        conn.execute(text(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_old'))
+        conn.execute(text(f'DROP TABLE {table}_old'))
+
+
+def upgrade_schema():
+    """Add missing columns and indexes to an existing database."""
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    with db.engine.begin() as conn:
+        for table, column, ddl, backfill in SCHEMA_UPGRADES:
+            if table not in existing_tables:
+                continue
+            columns = {c['name'] for c in inspector.get_columns(table)}
+            if column in columns:
+                continue
+            logger.info(f'Adding column {table}.{column}')
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+            if backfill:
+                conn.execute(text(backfill))
+    
+    for table, column in NULLABLE_COLUMNS:
+        if table not in existing_tables:
+            continue
+        if next(c for c in inspector.get_columns(table) if c['name'] == column)['nullable']:
+            continue
+        logger.info(f'Making {table}.{column} nullable')
+        if db.engine.dialect.name == 'sqlite':
+            rebuild_sqlite_table(table)
+        else:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} DROP NOT NULL'))
+    
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conn:
+            conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    
+    if db.engine.dialect.name == 'postgresql' and 'activity_logs' in existing_tables:
+        extra_data = next(c for c in inspector.get_columns('activity_logs') if c['name'] == 'extra_data')
+        if not isinstance(extra_data['type'], JSONB):
+            logger.info('Converting activity_logs.extra_data to JSONB')
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    'ALTER TABLE activity_logs ALTER COLUMN extra_data TYPE JSONB USING extra_data::jsonb'
+                ))
+    
+    # Create indexes declared on the models that don't exist yet
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                logger.warning(f'Could not create index {index.name}: {str(e)}')
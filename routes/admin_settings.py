@@ -1,58 +1,292 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Team, TeamMember, ActivityLog, Settings
+from models import (
+    db, User, Team, TeamMember, ActivityLog, Settings,
+    Post, Media, PostApproval, InstagramCache, Invitation
+)
+from settings_cache import get_email_settings_map, get_setting, invalidate_settings_cache
+from email_utils import smtp_pool
 from datetime import datetime
+from sqlalchemy import delete, exists, func, select, tuple_, update
+from sqlalchemy.orm import load_only, selectinload
+import base64
 import logging
+import string
+import threading
+import time
+from functools import wraps
 import bcrypt
 import os
 
 logger = logging.getLogger(__name__)
+
+# Short-lived cache for listing totals, which are only computed on request
+COUNT_CACHE_TTL = 30  # seconds
+COUNT_CACHE_MAX_ENTRIES = 500
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+TEST_EMAIL_TEMPLATE = string.Template("""
+<html>
+  <body>
+    <h2>PostWave Email Test</h2>
+    <p>If you're reading this, your email configuration is working correctly!</p>
+    <p><strong>Test Details:</strong></p>
+    <ul>
+      <li>Mail Server: ${server}:${port}</li>
+      <li>TLS Enabled: ${use_tls}</li>
+      <li>From Email: ${from_email}</li>
+      <li>Test Time: ${timestamp}</li>
+    </ul>
+    <p>You can now use PostWave to send emails for team invitations and notifications.</p>
+  </body>
+</html>
+""")
+
+MAX_USER_AGENT_LENGTH = 512
+
 admin_settings_bp = Blueprint('admin_settings', __name__, url_prefix='/api/admin-settings')
 
 
+@admin_settings_bp.before_request
+def capture_client_info():
+    """Read client address and user agent once, before any DB work starts"""
+    g.ip = request.remote_addr
+    g.ua = request.headers.get('User-Agent', '')[:MAX_USER_AGENT_LENGTH]
+
+
 def log_activity(user_id, action_type, description, resource_type=None, resource_id=None, metadata=None, team_id=None):
-    """Helper function to log activities"""
+    """
+    Add an activity log entry to the current transaction.
+
+    Callers log before committing, so the entry is written in the same commit
+    as the change it describes.
+    """
+    db.session.add(ActivityLog(
+        team_id=team_id,
+        user_id=user_id,
+        action_type=action_type,
+        description=description,
+        resource_type=resource_type,
+        resource_id=resource_id,
+        extra_data=metadata,
+        ip_address=g.ip,
+        user_agent=g.ua
+    ))
+
+
+def encode_cursor(created_at, row_id):
+    """Encode a (created_at, id) keyset position as an opaque cursor"""
+    raw = f'{created_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, returns None if it is malformed"""
     try:
-        log_entry = ActivityLog(
-            team_id=team_id,
-            user_id=user_id,
-            action_type=action_type,
-            description=description,
-            resource_type=resource_type,
-            resource_id=resource_id,
-            extra_data=metadata,
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent', '')
-        )
-        db.session.add(log_entry)
-        db.session.commit()
-    except Exception as e:
-        logger.error(f'Failed to log activity: {str(e)}')
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def fetch_page(query, keyset, page, per_page, cursor):
+    """
+    Fetch one page of (model, ...) rows without a COUNT query.
+    
+    Pages by cursor over the keyset columns the query is ordered by, or by
+    OFFSET when an explicit page number is given. One extra row is fetched
+    to tell whether a next page exists.
+    
+    Returns:
+        Tuple of (items, has_next, next_cursor)
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if page:
+        query = query.offset((max(page, 1) - 1) * per_page)
+    elif cursor:
+        position = decode_cursor(cursor)
+        if not position:
+            raise ValueError('Invalid cursor')
+        query = query.filter(tuple_(*keyset) < position)
+    
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+    has_next = len(rows) > per_page
+    next_cursor = None
+    if has_next:
+        last = items[-1][0]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return items, has_next, next_cursor
+
+
+def cached_count(cache_key, query):
+    """Count rows for a listing, reusing a recent result for the same key"""
+    now = time.monotonic()
+    with _count_cache_lock:
+        entry = _count_cache.get(cache_key)
+        if entry and entry[1] > now:
+            return entry[0]
+    
+    total = query.order_by(None).count()
+    with _count_cache_lock:
+        # Keys include free-text searches; drop expired ones as we go
+        for stale in [k for k, (_, expires) in _count_cache.items() if expires <= now]:
+            del _count_cache[stale]
+        if cache_key not in _count_cache and len(_count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+            # Still full of live entries: evict the one closest to expiry
+            del _count_cache[min(_count_cache, key=lambda k: _count_cache[k][1])]
+        _count_cache[cache_key] = (total, now + COUNT_CACHE_TTL)
+    return total
 
 
 def check_super_admin(user_id):
-    """Check if user is super admin"""
-    user = User.query.get(user_id)
-    return user and user.is_super_admin
+    """Check if user is an active super admin, memoized for the current request"""
+    cache = g.setdefault('is_super_admin_cache', {})
+    if user_id not in cache:
+        cache[user_id] = db.session.query(
+            exists().where(
+                User.id == user_id,
+                User.is_super_admin.is_(True),
+                User.is_active.isnot(False)
+            )
+        ).scalar()
+    return cache[user_id]
+
+
+def bulk_execute(stmt):
+    """Run a set-based DELETE/UPDATE without syncing objects in the session"""
+    return db.session.execute(stmt.execution_options(synchronize_session=False))
+
+
+def update_user_flag(user_id, precondition, **values):
+    """
+    Update a user in one UPDATE ... RETURNING, only when precondition holds.
+    
+    Returns:
+        The (id, name, email) row, or None if no user matched
+    """
+    return bulk_execute(
+        update(User)
+        .where(User.id == user_id, precondition)
+        .values(**values)
+        .returning(User.id, User.name, User.email)
+    ).first()
+
+
+def user_exists(user_id):
+    """Check whether a user row exists"""
+    return db.session.query(exists().where(User.id == user_id)).scalar()
+
+
+def other_team_owner(user_id):
+    """Correlated subquery: an owner of the outer Team row other than user_id"""
+    return select(TeamMember.user_id).where(
+        TeamMember.team_id == Team.id,
+        TeamMember.role == 'owner',
+        TeamMember.user_id != user_id
+    ).order_by(TeamMember.id).limit(1)
+
+
+def teams_blocking_user_delete(user_id):
+    """Names of teams created by user_id that have no other owner to take them over"""
+    return db.session.scalars(
+        select(Team.name).where(
+            Team.created_by == user_id,
+            ~other_team_owner(user_id).exists()
+        )
+    ).all()
+
+
+def delete_user_rows(user_id):
+    """
+    Delete a user and everything that depends on it with set-based statements.
+    
+    The foreign keys have no ON DELETE rules, so every dependent table is
+    handled here. Teams the user created are handed to another owner of the
+    team, so check teams_blocking_user_delete() first. Invitations the user
+    sent are deleted. Activity log entries are kept with the user cleared.
+    """
+    post_ids = select(Post.id).where(Post.user_id == user_id)
+    bulk_execute(delete(Media).where(Media.post_id.in_(post_ids)))
+    bulk_execute(delete(PostApproval).where(PostApproval.post_id.in_(post_ids)))
+    bulk_execute(update(PostApproval).where(PostApproval.reviewed_by == user_id).values(reviewed_by=None))
+    bulk_execute(delete(Post).where(Post.user_id == user_id))
+    bulk_execute(update(Team).where(Team.created_by == user_id).values(
+        created_by=other_team_owner(user_id).scalar_subquery()
+    ))
+    bulk_execute(delete(Invitation).where(Invitation.invited_by == user_id))
+    bulk_execute(delete(TeamMember).where(TeamMember.user_id == user_id))
+    bulk_execute(delete(InstagramCache).where(InstagramCache.user_id == user_id))
+    # Keep the audit trail, including actions the user took as an admin
+    bulk_execute(update(ActivityLog).where(ActivityLog.user_id == user_id).values(user_id=None))
+    bulk_execute(delete(User).where(User.id == user_id))
+
+
+def delete_team_rows(team_id):
+    """Delete a team and its posts, members and invitations with set-based statements"""
+    post_ids = select(Post.id).where(Post.team_id == team_id)
+    bulk_execute(delete(Media).where(Media.post_id.in_(post_ids)))
+    bulk_execute(delete(PostApproval).where(
+        (PostApproval.team_id == team_id) | PostApproval.post_id.in_(post_ids)
+    ))
+    bulk_execute(delete(Post).where(Post.team_id == team_id))
+    bulk_execute(delete(TeamMember).where(TeamMember.team_id == team_id))
+    bulk_execute(delete(Invitation).where(Invitation.team_id == team_id))
+    # Keep the team's activity history, as the ORM relationship did
+    bulk_execute(update(ActivityLog).where(ActivityLog.team_id == team_id).values(team_id=None))
+    bulk_execute(delete(Team).where(Team.id == team_id))
+
+
+def load_team_with_members(team_id):
+    """Load a team with its members and their users in a fixed number of queries"""
+    return Team.query.options(
+        selectinload(Team.members).selectinload(TeamMember.user)
+    ).populate_existing().filter_by(id=team_id).first()
+
+
+def require_super_admin(f):
+    """
+    Decorator restricting a route to super admins.
+
+    The database decides rather than the token's claim, so promoting,
+    demoting or deactivating an admin takes effect on their next request.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not check_super_admin(int(get_jwt_identity())):
+            return jsonify({'error': 'Unauthorized - Admin only'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
 
 
 # ==================== USER MANAGEMENT ====================
 
 @admin_settings_bp.route('/users', methods=['GET'])
 @jwt_required()
+@require_super_admin
 def get_all_users():
     """Get all users in the system"""
-    current_user_id = int(get_jwt_identity())
-    
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
-        page = request.args.get('page', 1, type=int)
+        page = request.args.get('page', type=int)
         per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '', type=str)
+        cursor = request.args.get('cursor', '', type=str)
+        
+        # Membership counts come from one grouped subquery instead of a
+        # lazy load of team_memberships per user
+        teams_count = db.session.query(
+            TeamMember.user_id,
+            func.count(TeamMember.id).label('cnt')
+        ).group_by(TeamMember.user_id).subquery()
         
-        query = User.query
+        query = User.query.options(
+            load_only(User.id, User.name, User.email, User.is_super_admin, User.is_active, User.created_at)
+        ).outerjoin(
+            teams_count, teams_count.c.user_id == User.id
+        ).add_columns(func.coalesce(teams_count.c.cnt, 0))
         
         # Search by name or email
         if search:
@@ -61,7 +295,22 @@ def get_all_users():
                 (User.email.ilike(f'%{search}%'))
             )
         
-        users = query.paginate(page=page, per_page=per_page, error_out=False)
+        query = query.order_by(User.created_at.desc(), User.id.desc())
+        
+        # Keyset pagination by default; OFFSET only when a page is explicitly
+        # requested. The total is only counted when asked for.
+        per_page = per_page if per_page > 0 else 20
+        try:
+            items, has_next, next_cursor = fetch_page(
+                query, (User.created_at, User.id), page, per_page, cursor
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        total = pages = None
+        if request.args.get('include_total', type=int):
+            total = cached_count(('users', search), query)
+            pages = -(-total // per_page)
         
         return jsonify({
             'users': [
@@ -71,13 +320,15 @@ def get_all_users():
                     'email': u.email,
                     'is_super_admin': u.is_super_admin,
                     'is_active': u.is_active,
-                    'created_at': u.created_at.isoformat(),
-                    'teams_count': len(u.team_memberships)
-                } for u in users.items
+                    'created_at': u.created_at,
+                    'teams_count': cnt
+                } for u, cnt in items
             ],
-            'total': users.total,
-            'pages': users.pages,
-            'current_page': page
+            'total': total,
+            'pages': pages,
+            'current_page': page,
+            'has_next': has_next,
+            'next_cursor': next_cursor
         }), 200
     
     except Exception as e:
@@ -87,24 +338,18 @@ def get_all_users():
 
 @admin_settings_bp.route('/users/<int:user_id>/promote', methods=['POST'])
 @jwt_required()
+@require_super_admin
 def promote_to_admin(user_id):
     """Promote user to super admin"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
-        user = User.query.get(user_id)
+        user = update_user_flag(user_id, User.is_super_admin.isnot(True), is_super_admin=True)
         if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        if user.is_super_admin:
+            if not user_exists(user_id):
+                return jsonify({'error': 'User not found'}), 404
             return jsonify({'error': 'User is already an admin'}), 400
         
-        user.is_super_admin = True
-        db.session.commit()
-        
         log_activity(
             current_user_id,
             'user_promoted',
@@ -112,6 +357,7 @@ def promote_to_admin(user_id):
             resource_type='user',
             resource_id=user_id
         )
+        db.session.commit()
         
         return jsonify({
             'message': f'User {user.email} promoted to super admin',
@@ -119,39 +365,34 @@ def promote_to_admin(user_id):
                 'id': user.id,
                 'name': user.name,
                 'email': user.email,
-                'is_super_admin': user.is_super_admin
+                'is_super_admin': True
             }
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to promote user: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to promote user'}), 500
 
 
 @admin_settings_bp.route('/users/<int:user_id>/demote', methods=['POST'])
 @jwt_required()
+@require_super_admin
 def demote_from_admin(user_id):
     """Demote super admin to regular user"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     # Prevent self-demotion
     if current_user_id == user_id:
         return jsonify({'error': 'Cannot demote yourself'}), 400
     
     try:
-        user = User.query.get(user_id)
+        user = update_user_flag(user_id, User.is_super_admin.is_(True), is_super_admin=False)
         if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        if not user.is_super_admin:
+            if not user_exists(user_id):
+                return jsonify({'error': 'User not found'}), 404
             return jsonify({'error': 'User is not an admin'}), 400
         
-        user.is_super_admin = False
-        db.session.commit()
-        
         log_activity(
             current_user_id,
             'user_demoted',
@@ -159,6 +400,7 @@ def demote_from_admin(user_id):
             resource_type='user',
             resource_id=user_id
         )
+        db.session.commit()
         
         return jsonify({
             'message': f'User {user.email} demoted from super admin',
@@ -166,38 +408,33 @@ def demote_from_admin(user_id):
                 'id': user.id,
                 'name': user.name,
                 'email': user.email,
-                'is_super_admin': user.is_super_admin
+                'is_super_admin': False
             }
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to demote user: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to demote user'}), 500
 
 
 @admin_settings_bp.route('/users/<int:user_id>/deactivate', methods=['POST'])
 @jwt_required()
+@require_super_admin
 def deactivate_user(user_id):
     """Deactivate a user account"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     if current_user_id == user_id:
         return jsonify({'error': 'Cannot deactivate yourself'}), 400
     
     try:
-        user = User.query.get(user_id)
+        user = update_user_flag(user_id, User.is_active.is_(True), is_active=False)
         if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        if not user.is_active:
+            if not user_exists(user_id):
+                return jsonify({'error': 'User not found'}), 404
             return jsonify({'error': 'User is already deactivated'}), 400
         
-        user.is_active = False
-        db.session.commit()
-        
         log_activity(
             current_user_id,
             'user_deactivated',
@@ -205,6 +442,7 @@ def deactivate_user(user_id):
             resource_type='user',
             resource_id=user_id
         )
+        db.session.commit()
         
         return jsonify({
             'message': f'User {user.email} deactivated',
@@ -212,35 +450,40 @@ def deactivate_user(user_id):
                 'id': user.id,
                 'name': user.name,
                 'email': user.email,
-                'is_active': user.is_active
+                'is_active': False
             }
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to deactivate user: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to deactivate user'}), 500
 
 
 @admin_settings_bp.route('/users/<int:user_id>/delete', methods=['DELETE'])
 @jwt_required()
+@require_super_admin
 def delete_user(user_id):
     """Delete a user account and all associated data"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     if current_user_id == user_id:
         return jsonify({'error': 'Cannot delete yourself'}), 400
     
     try:
-        user = User.query.get(user_id)
-        if not user:
+        user_email = db.session.scalar(select(User.email).where(User.id == user_id))
+        if user_email is None:
             return jsonify({'error': 'User not found'}), 404
         
-        user_email = user.email
-        db.session.delete(user)
-        db.session.commit()
+        blocking_teams = teams_blocking_user_delete(user_id)
+        if blocking_teams:
+            return jsonify({
+                'error': 'User created teams that have no other owner. '
+                         'Transfer ownership or delete these teams first.',
+                'teams': blocking_teams
+            }), 409
+        
+        delete_user_rows(user_id)
         
         log_activity(
             current_user_id,
@@ -249,10 +492,12 @@ def delete_user(user_id):
             resource_type='user',
             resource_id=user_id
         )
+        db.session.commit()
         
         return jsonify({'message': f'User {user_email} deleted successfully'}), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to delete user: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to delete user'}), 500
 
@@ -261,24 +506,48 @@ def delete_user(user_id):
 
 @admin_settings_bp.route('/teams', methods=['GET'])
 @jwt_required()
+@require_super_admin
 def get_all_teams():
     """Get all teams in the system"""
-    current_user_id = int(get_jwt_identity())
-    
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
-        page = request.args.get('page', 1, type=int)
+        page = request.args.get('page', type=int)
         per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '', type=str)
+        cursor = request.args.get('cursor', '', type=str)
         
-        query = Team.query
+        members_count = db.session.query(
+            TeamMember.team_id,
+            func.count(TeamMember.id).label('cnt')
+        ).group_by(TeamMember.team_id).subquery()
+        
+        query = Team.query.options(
+            load_only(
+                Team.id, Team.name, Team.description, Team.created_by, Team.created_at,
+                Team.instagram_username, Team.instagram_connected
+            )
+        ).outerjoin(
+            members_count, members_count.c.team_id == Team.id
+        ).add_columns(func.coalesce(members_count.c.cnt, 0))
         
         if search:
             query = query.filter(Team.name.ilike(f'%{search}%'))
         
-        teams = query.paginate(page=page, per_page=per_page, error_out=False)
+        query = query.order_by(Team.created_at.desc(), Team.id.desc())
+        
+        # Keyset pagination by default; OFFSET only when a page is explicitly
+        # requested. The total is only counted when asked for.
+        per_page = per_page if per_page > 0 else 20
+        try:
+            items, has_next, next_cursor = fetch_page(
+                query, (Team.created_at, Team.id), page, per_page, cursor
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        total = pages = None
+        if request.args.get('include_total', type=int):
+            total = cached_count(('teams', search), query)
+            pages = -(-total // per_page)
         
         return jsonify({
             'teams': [
@@ -287,15 +556,17 @@ def get_all_teams():
                     'name': t.name,
                     'description': t.description,
                     'created_by': t.created_by,
-                    'created_at': t.created_at.isoformat(),
+                    'created_at': t.created_at,
                     'instagram_username': t.instagram_username,
-                    'instagram_connected': bool(t.instagram_account_id),
-                    'members_count': len(t.members)
-                } for t in teams.items
+                    'instagram_connected': t.instagram_connected,
+                    'members_count': cnt
+                } for t, cnt in items
             ],
-            'total': teams.total,
-            'pages': teams.pages,
-            'current_page': page
+            'total': total,
+            'pages': pages,
+            'current_page': page,
+            'has_next': has_next,
+            'next_cursor': next_cursor
         }), 200
     
     except Exception as e:
@@ -305,13 +576,11 @@ def get_all_teams():
 
 @admin_settings_bp.route('/teams', methods=['POST'])
 @jwt_required()
+@require_super_admin
 def create_team_admin():
     """Admin create a new team"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
         data = request.get_json()
         
@@ -342,7 +611,6 @@ def create_team_admin():
             role='owner'
         )
         db.session.add(team_member)
-        db.session.commit()
         
         log_activity(
             current_user_id,
@@ -351,6 +619,9 @@ def create_team_admin():
             resource_type='team',
             resource_id=team.id
         )
+        db.session.commit()
+        
+        team = load_team_with_members(team.id)
         
         return jsonify({
             'message': 'Team created successfully',
@@ -358,19 +629,18 @@ def create_team_admin():
         }), 201
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to create team: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to create team'}), 500
 
 
 @admin_settings_bp.route('/teams/<int:team_id>', methods=['PUT'])
 @jwt_required()
+@require_super_admin
 def update_team_admin(team_id):
     """Admin update team details"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
         team = Team.query.get(team_id)
         if not team:
@@ -391,25 +661,25 @@ def update_team_admin(team_id):
         # Handle owner change
         if 'owner_id' in data and data['owner_id'] != team.created_by:
             new_owner_id = data['owner_id']
-            new_owner = User.query.get(new_owner_id)
-            if not new_owner:
+            if not db.session.query(exists().where(User.id == new_owner_id)).scalar():
                 return jsonify({'error': 'New owner not found'}), 404
             
+            # Lock both membership rows in one query, then flip roles in memory
+            members = {
+                m.user_id: m for m in TeamMember.query.filter(
+                    TeamMember.team_id == team_id,
+                    TeamMember.user_id.in_([team.created_by, new_owner_id])
+                ).with_for_update().all()
+            }
+            
             # Remove old owner role
-            old_owner_member = TeamMember.query.filter_by(
-                team_id=team_id,
-                user_id=team.created_by,
-                role='owner'
-            ).first()
-            if old_owner_member:
+            old_owner_member = members.get(team.created_by)
+            if old_owner_member and old_owner_member.role == 'owner':
                 old_owner_member.role = 'manager'
             
             # Set new owner
             team.created_by = new_owner_id
-            new_owner_member = TeamMember.query.filter_by(
-                team_id=team_id,
-                user_id=new_owner_id
-            ).first()
+            new_owner_member = members.get(new_owner_id)
             if new_owner_member:
                 new_owner_member.role = 'owner'
             else:
@@ -420,8 +690,6 @@ def update_team_admin(team_id):
                 )
                 db.session.add(new_member)
         
-        db.session.commit()
-        
         log_activity(
             current_user_id,
             'team_updated',
@@ -430,6 +698,9 @@ def update_team_admin(team_id):
             resource_id=team_id,
             metadata={'old_data': old_data, 'new_data': {k: v for k, v in data.items() if k in old_data}}
         )
+        db.session.commit()
+        
+        team = load_team_with_members(team_id)
         
         return jsonify({
             'message': 'Team updated successfully',
@@ -437,27 +708,24 @@ def update_team_admin(team_id):
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to update team: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to update team'}), 500
 
 
 @admin_settings_bp.route('/teams/<int:team_id>', methods=['DELETE'])
 @jwt_required()
+@require_super_admin
 def delete_team_admin(team_id):
     """Admin delete a team"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
-        team = Team.query.get(team_id)
-        if not team:
+        team_name = db.session.scalar(select(Team.name).where(Team.id == team_id))
+        if team_name is None:
             return jsonify({'error': 'Team not found'}), 404
         
-        team_name = team.name
-        db.session.delete(team)
-        db.session.commit()
+        delete_team_rows(team_id)
         
         log_activity(
             current_user_id,
@@ -466,10 +734,12 @@ def delete_team_admin(team_id):
             resource_type='team',
             resource_id=team_id
         )
+        db.session.commit()
         
         return jsonify({'message': f'Team {team_name} deleted successfully'}), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to delete team: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to delete team'}), 500
 
@@ -478,18 +748,12 @@ def delete_team_admin(team_id):
 
 @admin_settings_bp.route('/domain', methods=['GET'])
 @jwt_required()
+@require_super_admin
 def get_domain_setting():
     """Get application domain setting"""
-    current_user_id = int(get_jwt_identity())
-    
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
-        domain_setting = Settings.query.filter_by(key='app_domain').first()
-        
         return jsonify({
-            'domain': domain_setting.value if domain_setting else None
+            'domain': get_setting('app_domain')
         }), 200
     
     except Exception as e:
@@ -499,13 +763,11 @@ def get_domain_setting():
 
 @admin_settings_bp.route('/domain', methods=['POST'])
 @jwt_required()
+@require_super_admin
 def set_domain_setting():
     """Set application domain"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
         data = request.get_json()
         domain = data.get('domain', '').strip()
@@ -525,8 +787,6 @@ def set_domain_setting():
         else:
             domain_setting.value = domain
         
-        db.session.commit()
-        
         log_activity(
             current_user_id,
             'config_changed',
@@ -534,6 +794,8 @@ def set_domain_setting():
             resource_type='settings',
             resource_id=None
         )
+        db.session.commit()
+        invalidate_settings_cache()
         
         return jsonify({
             'message': 'Domain setting updated',
@@ -541,6 +803,7 @@ def set_domain_setting():
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to set domain: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to set domain'}), 500
 
@@ -549,40 +812,19 @@ def set_domain_setting():
 
 @admin_settings_bp.route('/email', methods=['GET'])
 @jwt_required()
+@require_super_admin
 def get_email_settings():
     """Get SMTP email settings"""
-    current_user_id = int(get_jwt_identity())
-    
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
         settings = {}
         
-        # Define email settings keys (both uppercase from onboarding and lowercase for consistency)
-        email_keys = [
-            'MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_TLS', 'MAIL_USERNAME', 
-            'MAIL_PASSWORD', 'MAIL_FROM_EMAIL', 'MAIL_FROM_NAME',
-            'mail_server', 'mail_port', 'mail_use_tls', 'mail_username',
-            'mail_password', 'mail_from_email', 'mail_from_name'
-        ]
-        
-        # Get from database
-        for key in email_keys:
-            setting = Settings.query.filter_by(key=key).first()
-            if setting:
-                value = setting.value
-                # Convert port to integer
-                if 'port' in key.lower():
-                    value = int(value) if value else 587
-                # Convert boolean string
-                elif 'tls' in key.lower():
-                    value = value.lower() == 'true' if isinstance(value, str) else value
-                # Store with lowercase key for consistency
-                normalized_key = key.lower()
-                settings[normalized_key] = value
-        
-        # Return with lowercase keys
+        for key, value in get_email_settings_map().items():
+            if key == 'mail_port':
+                value = int(value) if value else 587
+            elif key == 'mail_use_tls':
+                value = value.lower() == 'true' if isinstance(value, str) else value
+            settings[key] = value
+        
         return jsonify({
             'mail_server': settings.get('mail_server', ''),
             'mail_port': settings.get('mail_port', 587),
@@ -592,8 +834,6 @@ def get_email_settings():
             'mail_from_email': settings.get('mail_from_email', 'noreply@postwave.com'),
             'mail_from_name': settings.get('mail_from_name', 'PostWave')
         }), 200
-        
-        return jsonify(settings), 200
     
     except Exception as e:
         logger.error(f'Failed to get email settings: {str(e)}', exc_info=True)
@@ -602,13 +842,11 @@ def get_email_settings():
 
 @admin_settings_bp.route('/email', methods=['POST'])
 @jwt_required()
+@require_super_admin
 def set_email_settings():
     """Update SMTP email settings"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
     try:
         data = request.get_json()
         
@@ -623,16 +861,15 @@ def set_email_settings():
             'mail_from_name': data.get('mail_from_name', 'PostWave')
         }
         
-        # Update settings in database
-        for key, value in email_settings.items():
-            setting = Settings.query.filter_by(key=key).first()
-            if setting:
-                setting.value = value
-            else:
-                setting = Settings(key=key, value=value, setting_type='string' if key != 'mail_port' else 'integer')
-                db.session.add(setting)
-        
-        db.session.commit()
+        # Update settings in database with a single upsert
+        Settings.upsert([
+            {
+                'key': key,
+                'value': value,
+                'setting_type': 'string' if key != 'mail_port' else 'integer'
+            }
+            for key, value in email_settings.items()
+        ])
         
         log_activity(
             current_user_id,
@@ -642,6 +879,8 @@ def set_email_settings():
             resource_id=None,
             metadata={'updated_keys': list(email_settings.keys())}
         )
+        db.session.commit()
+        invalidate_settings_cache()
         
         return jsonify({
             'message': 'Email settings updated successfully',
@@ -649,43 +888,36 @@ def set_email_settings():
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to set email settings: {str(e)}', exc_info=True)
         return jsonify({'error': f'Failed to set email settings: {str(e)}'}), 500
 
 
 @admin_settings_bp.route('/email/test', methods=['POST'])
 @jwt_required()
+@require_super_admin
 def test_email():
     """Send a test email to verify SMTP configuration"""
     current_user_id = int(get_jwt_identity())
     
-    if not check_super_admin(current_user_id):
-        return jsonify({'error': 'Unauthorized - Admin only'}), 403
-    
-    user = User.query.get(current_user_id)
+    user_email = db.session.query(User.email).filter_by(id=current_user_id).scalar()
     
     try:
         data = request.get_json()
-        test_email_address = data.get('email', user.email)
+        test_email_address = data.get('email', user_email)
         
-        # Get current email settings (check both lowercase and uppercase keys)
-        mail_server = Settings.query.filter_by(key='mail_server').first() or Settings.query.filter_by(key='MAIL_SERVER').first()
-        mail_port = Settings.query.filter_by(key='mail_port').first() or Settings.query.filter_by(key='MAIL_PORT').first()
-        mail_use_tls = Settings.query.filter_by(key='mail_use_tls').first() or Settings.query.filter_by(key='MAIL_USE_TLS').first()
-        mail_username = Settings.query.filter_by(key='mail_username').first() or Settings.query.filter_by(key='MAIL_USERNAME').first()
-        mail_password = Settings.query.filter_by(key='mail_password').first() or Settings.query.filter_by(key='MAIL_PASSWORD').first()
-        mail_from_email = Settings.query.filter_by(key='mail_from_email').first() or Settings.query.filter_by(key='MAIL_FROM_EMAIL').first()
-        mail_from_name = Settings.query.filter_by(key='mail_from_name').first() or Settings.query.filter_by(key='MAIL_FROM_NAME').first()
+        # Current email settings, lowercase keys winning over uppercase ones
+        stored = get_email_settings_map()
         
         # Construct email configuration
         email_config = {
-            'server': mail_server.value if mail_server else current_app.config.get('MAIL_SERVER'),
-            'port': int(mail_port.value) if mail_port else current_app.config.get('MAIL_PORT', 587),
-            'use_tls': (mail_use_tls.value.lower() == 'true') if mail_use_tls else current_app.config.get('MAIL_USE_TLS', True),
-            'username': mail_username.value if mail_username else current_app.config.get('MAIL_USERNAME'),
-            'password': mail_password.value if mail_password else os.getenv('MAIL_PASSWORD', ''),
-            'from_email': mail_from_email.value if mail_from_email else current_app.config.get('MAIL_FROM_EMAIL'),
-            'from_name': mail_from_name.value if mail_from_name else current_app.config.get('MAIL_FROM_NAME', 'PostWave')
+            'server': stored.get('mail_server', current_app.config.get('MAIL_SERVER')),
+            'port': int(stored.get('mail_port', current_app.config.get('MAIL_PORT', 587))),
+            'use_tls': str(stored.get('mail_use_tls', current_app.config.get('MAIL_USE_TLS', True))).lower() == 'true',
+            'username': stored.get('mail_username', current_app.config.get('MAIL_USERNAME')),
+            'password': stored.get('mail_password', os.getenv('MAIL_PASSWORD', '')),
+            'from_email': stored.get('mail_from_email', current_app.config.get('MAIL_FROM_EMAIL')),
+            'from_name': stored.get('mail_from_name', current_app.config.get('MAIL_FROM_NAME', 'PostWave'))
         }
         
         # Validate settings
@@ -708,22 +940,7 @@ def test_email():
             msg['To'] = test_email_address
             msg['Subject'] = 'PostWave Email Configuration Test'
             
-            body = """
-<html>
-  <body>
-    <h2>PostWave Email Test</h2>
-    <p>If you're reading this, your email configuration is working correctly!</p>
-    <p><strong>Test Details:</strong></p>
-    <ul>
-      <li>Mail Server: {server}:{port}</li>
-      <li>TLS Enabled: {use_tls}</li>
-      <li>From Email: {from_email}</li>
-      <li>Test Time: {timestamp}</li>
-    </ul>
-    <p>You can now use PostWave to send emails for team invitations and notifications.</p>
-  </body>
-</html>
-            """.format(
+            body = TEST_EMAIL_TEMPLATE.substitute(
                 server=email_config['server'],
                 port=email_config['port'],
                 use_tls=email_config['use_tls'],
@@ -733,16 +950,20 @@ def test_email():
             
             msg.attach(MIMEText(body, 'html'))
             
-            # Connect and send
-            if email_config['use_tls']:
-                server = smtplib.SMTP(email_config['server'], email_config['port'], timeout=10)
-                server.starttls()
-            else:
-                server = smtplib.SMTP(email_config['server'], email_config['port'], timeout=10)
+            # End the read transaction first so the pooled DB connection isn't
+            # held for the whole SMTP round-trip
+            db.session.commit()
             
-            server.login(email_config['username'], email_config['password'])
-            server.send_message(msg)
-            server.quit()
+            # Send over a pooled connection, reused by later tests and invitations
+            smtp_pool.send_message(
+                msg,
+                server=email_config['server'],
+                port=email_config['port'],
+                use_tls=email_config['use_tls'],
+                username=email_config['username'],
+                password=email_config['password'],
+                timeout=10
+            )
             
             # Log successful test
             log_activity(
@@ -752,6 +973,7 @@ def test_email():
                 resource_type='settings',
                 metadata={'recipient': test_email_address}
             )
+            db.session.commit()
             
             return jsonify({
                 'message': f'Test email sent successfully to {test_email_address}',
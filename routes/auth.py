@@ -1,33 +1,47 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
-from models import db, User
+from models import db, User, hash_password, verify_password
+from sqlalchemy import select, update
+import events
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 auth_bp = Blueprint('auth', __name__)
 
+# Login-time cache refreshes share a small pool so bursts of logins queue up
+# instead of each starting a thread (and a Graph API call) of their own
+CACHE_REFRESH_WORKERS = 4
+cache_refresh_pool = ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix='ig-cache')
 
-def refresh_user_cache_async(user_id):
+
+def refresh_user_cache_async(app, user_id):
     """
     Refresh Instagram cache for a user asynchronously.
     Called after login to get fresh data.
     """
+    with app.app_context():
+        refresh_user_cache(user_id)
+
+
+def refresh_user_cache(user_id):
+    """Fetch the latest media for a user and store it in the cache"""
     try:
-        from instagram_api import InstagramAPI
+        from instagram_api import shared_api as ig_api
         from cache_manager import CacheManager
         
         user = User.query.get(user_id)
         if not user or not user.instagram_account_id or not user.instagram_access_token:
             return
         
-        ig_api = InstagramAPI()
         media_list = ig_api.get_media_list(
             user.instagram_access_token,
             user.instagram_account_id,
             limit=25
         )
         CacheManager.cache_posts_batch(user.id, media_list)
+        events.publish(user.id, 'instagram_cache_refreshed', {'count': len(media_list)})
         logger.info(f'Refreshed cache on login for user {user_id}')
     except Exception as e:
         logger.debug(f'Non-blocking cache refresh failed for user {user_id}: {str(e)}')
@@ -67,12 +81,11 @@ def login():
     refresh_token = create_refresh_token(identity=str(user.id))
     
     # Refresh cache asynchronously (non-blocking)
-    try:
-        from threading import Thread
-        cache_thread = Thread(target=refresh_user_cache_async, args=(user.id,), daemon=True)
-        cache_thread.start()
-    except Exception as e:
-        logger.debug(f'Failed to start cache refresh thread: {str(e)}')
+    if user.instagram_connected:
+        try:
+            cache_refresh_pool.submit(refresh_user_cache_async, current_app._get_current_object(), user.id)
+        except Exception as e:
+            logger.debug(f'Failed to queue cache refresh: {str(e)}')
     
     return jsonify({
         'access_token': access_token,
@@ -115,9 +128,11 @@ def change_password():
     Change user password.
     """
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
     
-    if not user:
+    # Only the hash is needed; skip loading the whole user row
+    password_hash = db.session.scalar(select(User.password_hash).where(User.id == current_user_id))
+    
+    if password_hash is None:
         return jsonify({'error': 'User not found'}), 404
     
     data = request.get_json()
@@ -125,10 +140,12 @@ def change_password():
     if not data or not data.get('old_password') or not data.get('new_password'):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    if not user.check_password(data['old_password']):
+    if not verify_password(password_hash, data['old_password']):
         return jsonify({'error': 'Invalid old password'}), 401
     
-    user.set_password(data['new_password'])
+    db.session.execute(
+        update(User).where(User.id == current_user_id).values(password_hash=hash_password(data['new_password']))
+    )
     db.session.commit()
     
     return jsonify({'message': 'Password changed successfully'}), 200
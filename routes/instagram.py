@@ -1,8 +1,13 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, current_app, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Team, InstagramCache
-from instagram_api import InstagramAPI
+from models import db, User, Team, TeamMember
+from instagram_api import shared_api as ig_api
 from cache_manager import CacheManager
+from url_signing import verify_url
+import events
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 from datetime import datetime
 import logging
 import os
@@ -11,7 +16,18 @@ import os
 logger = logging.getLogger(__name__)
 
 instagram_bp = Blueprint('instagram', __name__)
-ig_api = InstagramAPI()
+
+CACHED_IMAGE_MAX_AGE = 86400  # 1 day
+EVENTS_TOKEN_TTL = 60  # seconds an event stream token can be used to connect
+
+
+def attach_cached_image_urls(posts):
+    """Add cached_image_url to posts that have a cached image"""
+    urls = CacheManager.get_cached_image_urls([post['id'] for post in posts if post.get('id')])
+    for post in posts:
+        url = urls.get(post.get('id'))
+        if url:
+            post['cached_image_url'] = url
 
 
 @instagram_bp.route('/connect', methods=['POST'])
@@ -45,19 +61,21 @@ def connect_instagram():
         
         # Get Instagram Business Account ID - two methods
         ig_account_id = None
+        account_info = {}
         
         # Method 1: Direct Instagram Account ID provided (bypass page lookup)
         if data.get('instagram_account_id'):
             ig_account_id = data['instagram_account_id']
             logger.info(f'Using directly provided Instagram Account ID: {ig_account_id}')
         
-        # Method 2: Look up via Facebook Page ID
+        # Method 2: Look up via Facebook Page ID (account info comes back in the same call)
         elif data.get('page_id'):
             logger.debug(f'Getting Instagram Business Account for page {data["page_id"]}...')
-            ig_account_id = ig_api.get_instagram_business_account(
-                token_data['access_token'],
-                data['page_id']
+            account_info = ig_api.get_page_instagram_account(
+                data['page_id'],
+                token_data['access_token']
             )
+            ig_account_id = account_info.get('id')
             
             if not ig_account_id:
                 error_msg = 'No Instagram Business Account found for this page. Try providing instagram_account_id directly instead.'
@@ -71,8 +89,9 @@ def connect_instagram():
         logger.info(f'Using Instagram Business Account: {ig_account_id}')
         
         # Get account info
-        logger.debug('Retrieving account information...')
-        account_info = ig_api.get_account_info(ig_account_id, token_data['access_token'])
+        if 'username' not in account_info:
+            logger.debug('Retrieving account information...')
+            account_info = ig_api.get_account_info(ig_account_id, token_data['access_token'])
         
         # Update user
         user.instagram_account_id = ig_account_id
@@ -148,18 +167,28 @@ def disconnect_instagram():
     Disconnect Instagram account.
     """
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
-    
-    if not user:
+    account_id = db.session.scalar(
+        select(User.instagram_account_id).where(User.id == current_user_id)
+    )
+    
+    # One UPDATE instead of loading the user first. Bulk updates skip ORM
+    # attribute events, so instagram_connected is cleared explicitly.
+    updated = db.session.query(User).filter(User.id == current_user_id).update({
+        User.instagram_account_id: None,
+        User.instagram_access_token: None,
+        User.instagram_username: None,
+        User.token_expires_at: None,
+        User.instagram_connected: False
+    }, synchronize_session=False)
+    
+    if not updated:
         return jsonify({'error': 'User not found'}), 404
     
-    user.instagram_account_id = None
-    user.instagram_access_token = None
-    user.instagram_username = None
-    user.token_expires_at = None
-    
     db.session.commit()
     
+    if account_id:
+        ig_api.invalidate_account_info(account_id)
+    
     return jsonify({'message': 'Instagram disconnected successfully'}), 200
 
 
@@ -190,8 +219,9 @@ def instagram_status():
         }), 200
     
     try:
-        # Try to get account info to verify connection
-        account_info = ig_api.get_account_info(
+        # Try to get account info to verify connection. Clients poll this,
+        # so a recent successful check is reused instead of calling Graph again.
+        account_info = ig_api.get_account_info_cached(
             user.instagram_account_id,
             user.instagram_access_token
         )
@@ -200,7 +230,7 @@ def instagram_status():
             'connected': True,
             'instagram_username': user.instagram_username,
             'account_info': account_info,
-            'token_expires_at': user.token_expires_at.isoformat() if user.token_expires_at else None
+            'token_expires_at': user.token_expires_at
         }), 200
     
     except Exception as e:
@@ -222,7 +252,9 @@ def get_instagram_posts():
     - refresh: Force refresh from Instagram (overrides use_cache)
     """
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = User.query.options(
+        selectinload(User.team_memberships).joinedload(TeamMember.team)
+    ).get(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -256,11 +288,7 @@ def get_instagram_posts():
             use_cache=use_cache
         )
         
-        # Enhance posts with cached image URLs
-        for post in posts:
-            cache = CacheManager.get_cached_post(post.get('id'))
-            if cache and cache.cached_image_path:
-                post['cached_image_url'] = f"/api/instagram/cache-image/{cache.id}"
+        attach_cached_image_urls(posts)
         
         return jsonify({
             'posts': posts,
@@ -305,11 +333,7 @@ def refresh_cache():
             use_cache=False
         )
         
-        # Enhance posts with cached image URLs
-        for post in posts:
-            cache = CacheManager.get_cached_post(post.get('id'))
-            if cache and cache.cached_image_path:
-                post['cached_image_url'] = f"/api/instagram/cache-image/{cache.id}"
+        attach_cached_image_urls(posts)
         
         return jsonify({
             'message': 'Cache refreshed successfully',
@@ -328,24 +352,90 @@ def refresh_cache():
 def get_cached_image(cache_id):
     """
     Serve cached Instagram image.
+    
+    Requires a signed URL from the posts endpoints; the file is located from
+    the signed filename without a database lookup.
+    
+    Query params:
+    - f: Image filename
+    - e: Expiry timestamp
+    - s: Signature
     """
+    filename = request.args.get('f', '', type=str)
+    expires = request.args.get('e', type=int)
+    signature = request.args.get('s', '', type=str)
+    
+    if not verify_url(CacheManager.IMAGE_URL_PURPOSE, cache_id, filename, expires, signature):
+        return jsonify({'error': 'Invalid or expired image link'}), 403
+    
     try:
-        cache = InstagramCache.query.get(cache_id)
-        
-        if not cache or not cache.cached_image_path or not os.path.exists(cache.cached_image_path):
-            return jsonify({'error': 'Image not found'}), 404
-        
+        # Conditional responses let browsers revalidate with a 304 instead of
+        # downloading the image again. send_file stats the file itself, so a
+        # missing file is caught below rather than checked up front.
         return send_file(
-            cache.cached_image_path,
+            # Resolved against the working directory, like the downloader writes it
+            os.path.abspath(os.path.join(CacheManager.CACHE_IMAGE_FOLDER, os.path.basename(filename))),
             mimetype='image/jpeg',
-            as_attachment=False
+            as_attachment=False,
+            conditional=True,
+            etag=True,
+            max_age=CACHED_IMAGE_MAX_AGE
         )
     
+    except FileNotFoundError:
+        return jsonify({'error': 'Image not found'}), 404
     except Exception as e:
         logger.error(f'Failed to serve cached image: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to serve image'}), 500
 
 
+def events_token_serializer():
+    """Signer for event stream tokens; they can't be used as access tokens"""
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='instagram-events')
+
+
+@instagram_bp.route('/events/token', methods=['POST'])
+@jwt_required()
+def instagram_events_token():
+    """
+    Issue a short-lived token for opening the event stream.
+    
+    EventSource can't send headers, so the stream URL carries this token
+    instead of the access token, keeping the latter out of access logs and
+    browser history.
+    """
+    token = events_token_serializer().dumps(int(get_jwt_identity()))
+    return jsonify({'token': token, 'expires_in': EVENTS_TOKEN_TTL}), 200
+
+
+@instagram_bp.route('/events', methods=['GET'])
+def instagram_events():
+    """
+    Server-sent event stream of Instagram updates for the current user.
+    
+    Authenticated by the token query parameter from /events/token. Streams
+    end after events.STREAM_MAX_SECONDS and the client reconnects.
+    
+    Events:
+    - instagram_cache_refreshed: cached posts were refreshed
+    - post_status: a scheduled post was published or failed
+    - stream_limit: the user has too many open streams; the stream ends
+    """
+    try:
+        current_user_id = events_token_serializer().loads(
+            request.args.get('token', ''), max_age=EVENTS_TOKEN_TTL
+        )
+    except BadSignature:
+        return jsonify({'error': 'Invalid or expired event stream token'}), 401
+    
+    response = Response(
+        events.stream(current_user_id),
+        mimetype='text/event-stream'
+    )
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+
 @instagram_bp.route('/cache-stats', methods=['GET'])
 @jwt_required()
 def get_cache_stats():
@@ -412,9 +502,10 @@ def fetch_profile_picture():
             # Cache the profile picture locally
             cached_path = CacheManager.cache_profile_picture(current_user_id, profile_picture_url)
             
-            # Save the profile picture URL to user record
-            user.instagram_profile_picture = profile_picture_url
-            db.session.commit()
+            # Save the profile picture URL to user record (skip the write if unchanged)
+            if user.instagram_profile_picture != profile_picture_url:
+                user.instagram_profile_picture = profile_picture_url
+                db.session.commit()
             
             logger.info(f'Profile picture cached successfully for user {current_user_id}')
             
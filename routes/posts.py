@@ -1,23 +1,95 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify, send_from_directory, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
+from sqlalchemy import func, insert
+from sqlalchemy.orm import selectinload
 from models import db, User, Post, Media, Team
+from settings_cache import get_setting
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import os
+import logging
+import threading
+import time
+import uuid
 from config import Config
+import events
+from url_signing import sign_url, verify_url
 
+logger = logging.getLogger(__name__)
 posts_bp = Blueprint('posts', __name__)
 
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+# Media file writes and deletes run on a small pool; the syscalls release the GIL
+MEDIA_IO_WORKERS = 4
+media_io_pool = ThreadPoolExecutor(max_workers=MEDIA_IO_WORKERS, thread_name_prefix='media-io')
 
+# Immediate publishes run off the request thread
+publish_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='publish')
 
-def invalidate_dashboard_cache():
-    """Helper function to invalidate dashboard cache when posts change"""
-    # The frontend will clear localStorage cache on specific operations
-    # This is called after any post modifications to signal the frontend
-    pass
+MEDIA_MAX_AGE = 86400  # 1 day
+MEDIA_URL_TTL = 3600  # Instagram fetches the media while the publish is in progress
+MEDIA_URL_PURPOSE = 'media'
+
+# Upcoming posts per user, keyed by dashboard version so any change to the
+# user's posts misses the cache. The TTL covers posts whose time has passed.
+UPCOMING_CACHE_TTL = 60  # seconds
+UPCOMING_CACHE_MAX_ENTRIES = 1000
+_upcoming_cache = {}  # user_id -> (dashboard_version, expires_at, response body)
+_upcoming_lock = threading.Lock()
+
+VIDEO_EXTENSIONS = frozenset({'mp4'})
+
+
+def classify_file(filename):
+    """
+    Check an upload's extension and work out its media type in one pass.
+    Returns (allowed, media_type).
+    """
+    ext = os.path.splitext(filename)[1][1:].lower()
+    if ext not in Config.ALLOWED_EXTENSIONS:
+        return False, None
+    return True, 'video' if ext in VIDEO_EXTENSIONS else 'image'
+
+
+def public_media_urls(post):
+    """
+    Build signed, publicly reachable URLs for a post's media, for Instagram to
+    fetch when publishing.
+    
+    The URLs carry the stored filename, so serving them needs no database
+    lookup, and they expire after MEDIA_URL_TTL.
+    """
+    app_host = get_setting('app_domain') or os.getenv('APP_HOST', 'http://127.0.0.1:5500')
+    expires = int(time.time()) + MEDIA_URL_TTL
+    return [
+        f"{app_host}/api/posts/media/{media.id}"
+        f"?f={media.filename}&e={expires}&s={sign_url(MEDIA_URL_PURPOSE, media.id, media.filename, expires)}"
+        for media in post.media
+    ]
+
+
+def remove_media_files(paths):
+    """Delete media files from disk, ignoring ones that are already gone"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting file {path}: {e}")
+
+
+def lock_post(post_id):
+    """Load a post and its media for modification, locking the post row until the transaction ends"""
+    return Post.query.options(selectinload(Post.media)).filter(
+        Post.id == post_id
+    ).with_for_update().populate_existing().first()
+
+
+def mark_dashboard_changed(response, version):
+    """Tell the client its cached dashboard data is out of date"""
+    response.headers['X-Invalidate-Dashboard-Cache'] = 'true'
+    response.headers['X-Dashboard-Version'] = str(version)
 
 
 @posts_bp.route('/', methods=['GET'])
@@ -25,15 +97,16 @@ def invalidate_dashboard_cache():
 def get_posts():
     """
     Get all posts for current user.
-    Query params: status (optional), limit, offset
+    Query params: status (optional), limit, offset, with_total (optional)
     """
     current_user_id = int(get_jwt_identity())
     
     status = request.args.get('status')
     limit = request.args.get('limit', 50, type=int)
     offset = request.args.get('offset', 0, type=int)
+    with_total = request.args.get('with_total', '').lower() in ('1', 'true')
     
-    query = Post.query.filter_by(user_id=current_user_id)
+    query = Post.query.options(selectinload(Post.media)).filter_by(user_id=current_user_id)
     
     if status:
         query = query.filter_by(status=status)
@@ -41,10 +114,24 @@ def get_posts():
     query = query.order_by(Post.scheduled_time.desc())
     posts = query.limit(limit).offset(offset).all()
     
-    return jsonify({
+    dashboard_version = db.session.query(User.dashboard_version).filter_by(id=current_user_id).scalar()
+    
+    response = {
         'posts': [post.to_dict() for post in posts],
-        'total': query.count()
-    }), 200
+        'has_more': len(posts) == limit,
+        'dashboard_version': dashboard_version
+    }
+    
+    # Counting is a second query, so only do it when the caller asks
+    if with_total:
+        count_query = db.session.query(func.count(Post.id)).filter(Post.user_id == current_user_id)
+        if status:
+            count_query = count_query.filter(Post.status == status)
+        response['total'] = count_query.scalar()
+    
+    response = jsonify(response)
+    response.headers['X-Dashboard-Version'] = str(dashboard_version)
+    return response, 200
 
 
 @posts_bp.route('/<int:post_id>', methods=['GET'])
@@ -54,9 +141,9 @@ def get_post(post_id):
     Get a specific post.
     """
     current_user_id = int(get_jwt_identity())
-    post = Post.query.filter_by(id=post_id, user_id=current_user_id).first()
+    post = db.session.get(Post, post_id, options=[selectinload(Post.media)])
     
-    if not post:
+    if not post or post.user_id != current_user_id:
         return jsonify({'error': 'Post not found'}), 404
     
     return jsonify(post.to_dict()), 200
@@ -98,54 +185,77 @@ def create_post():
         return jsonify({'error': 'Maximum 10 media files allowed'}), 400
     
     # Validate all files
+    media_types = []
     for file in files:
         if not file or file.filename == '':
             return jsonify({'error': 'Invalid file'}), 400
-        if not allowed_file(file.filename):
+        allowed, media_type = classify_file(file.filename)
+        if not allowed:
             return jsonify({'error': f'File type not allowed: {file.filename}'}), 400
+        media_types.append(media_type)
     
-    # Create post
+    # Create post. It stays a draft until its files are on disk, so the
+    # scheduler can't pick it up and publish URLs that don't resolve yet.
     post = Post(
         user_id=current_user_id,
         caption=caption,
         scheduled_time=scheduled_time,
-        status=status
+        status='draft'
     )
     
     db.session.add(post)
     db.session.flush()  # Get post ID
     
-    # Save files and create media records
-    for idx, file in enumerate(files):
+    # Create media records first so the transaction is not held open during disk I/O
+    uploads = []
+    media_rows = []
+    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    for idx, (file, media_type) in enumerate(zip(files, media_types)):
         filename = secure_filename(file.filename)
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        unique_filename = f"{current_user_id}_{post.id}_{timestamp}_{idx}_{filename}"
+        unique_filename = f"{current_user_id}_{post.id}_{timestamp}_{idx}_{uuid.uuid4().hex[:8]}_{filename}"
         filepath = os.path.join(Config.UPLOAD_FOLDER, unique_filename)
         
-        file.save(filepath)
-        
-        # Determine media type
-        ext = filename.rsplit('.', 1)[1].lower()
-        media_type = 'video' if ext == 'mp4' else 'image'
-        
-        media = Media(
-            post_id=post.id,
-            filename=unique_filename,
-            filepath=filepath,
-            media_type=media_type,
-            order=idx
-        )
-        db.session.add(media)
+        media_rows.append({
+            'post_id': post.id,
+            'filename': unique_filename,
+            'filepath': filepath,
+            'media_type': media_type,
+            'order': idx
+        })
+        uploads.append((file, filepath))
     
+    # One executemany for all media rows instead of per-object unit-of-work flushes
+    db.session.execute(insert(Media), media_rows)
+    dashboard_version = User.bump_dashboard_version(current_user_id)
     db.session.commit()
     
+    # Write the files concurrently
+    futures = [media_io_pool.submit(file.save, filepath) for file, filepath in uploads]
+    errors = [future.exception() for future in futures]
+    
+    if any(errors):
+        logger.error(f"Error saving media for post {post.id}: {next(e for e in errors if e)}")
+        # Undo the post and whatever files did get written
+        remove_media_files([filepath for _, filepath in uploads])
+        db.session.delete(post)
+        dashboard_version = User.bump_dashboard_version(current_user_id)
+        db.session.commit()
+        response = jsonify({'error': 'Failed to save media files'})
+        mark_dashboard_changed(response, dashboard_version)
+        return response, 500
+    
+    if status != 'draft':
+        post.status = status
+        dashboard_version = User.bump_dashboard_version(current_user_id)
+        db.session.commit()
+    
     # Add cache invalidation response header
     response = jsonify({
         'message': 'Post created successfully',
         'post': post.to_dict(),
         'invalidate_cache': True
     })
-    response.headers['X-Invalidate-Dashboard-Cache'] = 'true'
+    mark_dashboard_changed(response, dashboard_version)
     return response, 201
 
 
@@ -156,9 +266,9 @@ def update_post(post_id):
     Update a post.
     """
     current_user_id = int(get_jwt_identity())
-    post = Post.query.filter_by(id=post_id, user_id=current_user_id).first()
+    post = lock_post(post_id)
     
-    if not post:
+    if not post or post.user_id != current_user_id:
         return jsonify({'error': 'Post not found'}), 404
     
     if post.status == 'published':
@@ -181,6 +291,7 @@ def update_post(post_id):
             return jsonify({'error': 'Invalid status'}), 400
         post.status = data['status']
     
+    dashboard_version = User.bump_dashboard_version(current_user_id)
     db.session.commit()
     
     response = jsonify({
@@ -188,7 +299,7 @@ def update_post(post_id):
         'post': post.to_dict(),
         'invalidate_cache': True
     })
-    response.headers['X-Invalidate-Dashboard-Cache'] = 'true'
+    mark_dashboard_changed(response, dashboard_version)
     return response, 200
 
 
@@ -199,59 +310,50 @@ def delete_post(post_id):
     Delete a post and its media files.
     """
     current_user_id = int(get_jwt_identity())
-    post = Post.query.filter_by(id=post_id, user_id=current_user_id).first()
+    post = lock_post(post_id)
     
-    if not post:
+    if not post or post.user_id != current_user_id:
         return jsonify({'error': 'Post not found'}), 404
     
-    # Delete media files
-    for media in post.media:
-        try:
-            if os.path.exists(media.filepath):
-                os.remove(media.filepath)
-        except Exception as e:
-            print(f"Error deleting file {media.filepath}: {e}")
+    paths = [media.filepath for media in post.media]
     
     db.session.delete(post)
+    dashboard_version = User.bump_dashboard_version(current_user_id)
     db.session.commit()
     
+    # Remove the files after the rows are gone, without holding up the response
+    media_io_pool.submit(remove_media_files, paths)
+    
     response = jsonify({
         'message': 'Post deleted successfully',
         'invalidate_cache': True
     })
-    response.headers['X-Invalidate-Dashboard-Cache'] = 'true'
+    mark_dashboard_changed(response, dashboard_version)
     return response, 200
 
 
-@posts_bp.route('/<int:post_id>/publish', methods=['POST'])
-@jwt_required()
-def publish_post_now(post_id):
+def publish_post_async(app, post_id):
     """
-    Publish a post immediately (for testing).
+    Publish a claimed post to Instagram in the background.
+    The post must already be in 'publishing' status.
     """
-    current_user_id = int(get_jwt_identity())
-    post = Post.query.filter_by(id=post_id, user_id=current_user_id).first()
-    
-    if not post:
-        return jsonify({'error': 'Post not found'}), 404
-    
-    if post.status == 'published':
-        return jsonify({'error': 'Post already published'}), 400
-    
-    user = User.query.get(current_user_id)
-    
-    if not user.instagram_access_token or not user.instagram_account_id:
-        return jsonify({'error': 'Instagram not connected'}), 400
+    with app.app_context():
+        publish_claimed_post(post_id)
+
+
+def publish_claimed_post(post_id):
+    """Publish a post and record the outcome"""
+    from instagram_api import shared_api as ig_api
     
-    from instagram_api import InstagramAPI
-    ig_api = InstagramAPI()
+    row = db.session.query(Post, User).options(selectinload(Post.media)).join(
+        User, User.id == Post.user_id
+    ).filter(Post.id == post_id).first()
+    if not row or row.Post.status != 'publishing':
+        return
+    post, user = row
     
     try:
-        # Note: In production, media URLs need to be publicly accessible
-        media_urls = [
-            f"http://your-domain.com/api/posts/media/{media.id}"
-            for media in post.media
-        ]
+        media_urls = public_media_urls(post)
         
         instagram_post_id = ig_api.publish_post(
             user.instagram_access_token,
@@ -264,37 +366,81 @@ def publish_post_now(post_id):
         post.instagram_post_id = instagram_post_id
         post.published_at = datetime.utcnow()
         post.error_message = None
-        
-        db.session.commit()
-        
-        response = jsonify({
-            'message': 'Post published successfully',
-            'post': post.to_dict(),
-            'invalidate_cache': True
-        })
-        response.headers['X-Invalidate-Dashboard-Cache'] = 'true'
-        return response, 200
-    
     except Exception as e:
+        logger.error(f"Error publishing post {post_id}: {str(e)}", exc_info=True)
         post.status = 'failed'
         post.error_message = str(e)
-        db.session.commit()
-        
-        return jsonify({'error': str(e)}), 400
+    
+    User.bump_dashboard_version(post.user_id)
+    db.session.commit()
+    events.publish(post.user_id, 'post_status', {'post_id': post.id, 'status': post.status})
+
+
+@posts_bp.route('/<int:post_id>/publish', methods=['POST'])
+@jwt_required()
+def publish_post_now(post_id):
+    """
+    Publish a post immediately (for testing).
+    The publish runs in the background; the final status arrives as a
+    post_status event.
+    """
+    current_user_id = int(get_jwt_identity())
+    row = db.session.query(Post, User).join(User, User.id == Post.user_id).filter(
+        Post.id == post_id, Post.user_id == current_user_id
+    ).first()
+    
+    if not row:
+        return jsonify({'error': 'Post not found'}), 404
+    post, user = row
+    
+    if post.status == 'published':
+        return jsonify({'error': 'Post already published'}), 400
+    
+    if not user.instagram_access_token or not user.instagram_account_id:
+        return jsonify({'error': 'Instagram not connected'}), 400
+    
+    # Claim the post atomically so repeated requests and the scheduler can't
+    # publish it twice
+    if not Post.claim_for_publishing(post_id):
+        db.session.rollback()
+        return jsonify({'error': 'Post is already being published'}), 409
+    
+    dashboard_version = User.bump_dashboard_version(current_user_id)
+    db.session.commit()
+    
+    publish_pool.submit(publish_post_async, current_app._get_current_object(), post_id)
+    
+    post = db.session.get(Post, post_id, options=[selectinload(Post.media)], populate_existing=True)
+    response = jsonify({
+        'message': 'Post is being published',
+        'post': post.to_dict(),
+        'invalidate_cache': True
+    })
+    mark_dashboard_changed(response, dashboard_version)
+    return response, 202
 
 
 @posts_bp.route('/media/<int:media_id>', methods=['GET'])
 def serve_media(media_id):
     """
     Serve media file (for preview and Instagram API).
+    Signed URLs from public_media_urls() are served without a database lookup.
     """
-    media = Media.query.get(media_id)
-    
-    if not media:
-        return jsonify({'error': 'Media not found'}), 404
+    signature = request.args.get('s')
+    if signature:
+        filename = request.args.get('f', '')
+        expires = request.args.get('e', type=int)
+        if not verify_url(MEDIA_URL_PURPOSE, media_id, filename, expires, signature):
+            return jsonify({'error': 'Invalid or expired media URL'}), 403
+    else:
+        media = Media.query.get(media_id)
+        
+        if not media:
+            return jsonify({'error': 'Media not found'}), 404
+        filename = media.filename
     
     # Determine MIME type based on file extension
-    ext = media.filename.rsplit('.', 1)[1].lower() if '.' in media.filename else ''
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
     mime_type_map = {
         'jpg': 'image/jpeg',
         'jpeg': 'image/jpeg',
@@ -307,12 +453,19 @@ def serve_media(media_id):
     }
     mime_type = mime_type_map.get(ext, 'application/octet-stream')
     
-    return send_from_directory(
-        Config.UPLOAD_FOLDER,
-        media.filename,
+    # Files are written relative to the working directory, not the app root
+    response = send_from_directory(
+        os.path.abspath(Config.UPLOAD_FOLDER),
+        filename,
         as_attachment=False,
-        mimetype=mime_type
+        mimetype=mime_type,
+        conditional=True,
+        max_age=MEDIA_MAX_AGE
     )
+    # Upload filenames are unique per post and index, so the bytes never change
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 @posts_bp.route('/upcoming', methods=['GET'])
@@ -322,14 +475,31 @@ def get_upcoming_posts():
     Get upcoming scheduled posts.
     """
     current_user_id = int(get_jwt_identity())
-    
-    now = datetime.utcnow()
-    posts = Post.query.filter(
-        Post.user_id == current_user_id,
-        Post.status == 'scheduled',
-        Post.scheduled_time >= now
-    ).order_by(Post.scheduled_time.asc()).limit(10).all()
-    
-    return jsonify({
-        'posts': [post.to_dict() for post in posts]
-    }), 200
+    dashboard_version = db.session.query(User.dashboard_version).filter_by(id=current_user_id).scalar()
+    
+    now = time.monotonic()
+    with _upcoming_lock:
+        entry = _upcoming_cache.get(current_user_id)
+    if entry and entry[0] == dashboard_version and entry[1] > now:
+        response = current_app.response_class(entry[2], mimetype='application/json')
+    else:
+        posts = Post.query.options(selectinload(Post.media)).filter(
+            Post.user_id == current_user_id,
+            Post.status == 'scheduled',
+            Post.scheduled_time >= datetime.utcnow()
+        ).order_by(Post.scheduled_time.asc()).limit(10).all()
+        
+        response = jsonify({
+            'posts': [post.to_dict() for post in posts]
+        })
+        with _upcoming_lock:
+            # Users who stop polling leave entries behind; drop expired ones as we go
+            for stale in [k for k, (_, expires, _) in _upcoming_cache.items() if expires <= now]:
+                del _upcoming_cache[stale]
+            if current_user_id not in _upcoming_cache and len(_upcoming_cache) >= UPCOMING_CACHE_MAX_ENTRIES:
+                # Still full of live entries: evict the one closest to expiry
+                del _upcoming_cache[min(_upcoming_cache, key=lambda k: _upcoming_cache[k][1])]
+            _upcoming_cache[current_user_id] = (dashboard_version, now + UPCOMING_CACHE_TTL, response.get_data())
+    
+    response.headers['X-Dashboard-Version'] = str(dashboard_version)
+    return response, 200
@@ -2,7 +2,10 @@
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import exists, update
+from sqlalchemy.orm import selectinload
 from models import db, User, Post, PostApproval, Team, TeamMember
+from routes.admin_settings import check_super_admin
 from datetime import datetime
 import logging
 
@@ -10,45 +13,121 @@ logger = logging.getLogger(__name__)
 posts_bp = Blueprint('posts_approval', __name__)
 
 
+def is_team_member(user_id, team_id):
+    """Check team membership with a single indexed lookup"""
+    return db.session.query(TeamMember.id).filter_by(
+        user_id=user_id, team_id=team_id
+    ).first() is not None
+
+
+def review_post(post_id, reviewer_id, approval_status, comments, **post_values):
+    """
+    Move a pending post out of review with conditional UPDATEs.
+    
+    The post is only updated while it is pending approval and the reviewer
+    leads its team (or is a super admin), so permission and state are checked
+    by the database in the same statement that makes the change.
+    
+    Returns:
+        True if the post was updated, False otherwise
+    """
+    conditions = [Post.id == post_id, Post.status == 'pending_approval']
+    if not check_super_admin(reviewer_id):
+        conditions.append(exists().where(
+            TeamMember.team_id == Post.team_id,
+            TeamMember.user_id == reviewer_id,
+            TeamMember.role == 'leader'
+        ))
+    
+    row = db.session.execute(
+        update(Post)
+        .where(*conditions)
+        .values(**post_values)
+        .returning(Post.team_id, Post.user_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if not row:
+        return False
+    
+    db.session.execute(
+        update(PostApproval)
+        .where(
+            PostApproval.post_id == post_id,
+            PostApproval.team_id == row.team_id,
+            PostApproval.status == 'pending'
+        )
+        .values(
+            status=approval_status,
+            reviewed_by=reviewer_id,
+            review_comments=comments,
+            reviewed_at=datetime.utcnow()
+        )
+        .execution_options(synchronize_session=False)
+    )
+    User.bump_dashboard_version(row.user_id)
+    return True
+
+
+def review_failure(post_id, action):
+    """Work out why review_post() didn't update a post"""
+    post = db.session.get(Post, post_id)
+    if not post:
+        return jsonify({'error': 'Post not found'}), 404
+    if post.status != 'pending_approval':
+        return jsonify({'error': 'Post is not pending approval'}), 400
+    return jsonify({'error': f'Only team leaders can {action} posts'}), 403
+
+
+def load_post(post_id):
+    """Load a post with its media for the response"""
+    return db.session.get(Post, post_id, options=[selectinload(Post.media)], populate_existing=True)
+
+
 @posts_bp.route('/team/<int:team_id>/posts', methods=['GET'])
 @jwt_required()
 def get_team_posts(team_id):
     """Get all posts for a team. Only team members or super admin."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
-    
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
     
-    team = Team.query.get(team_id)
+    team = db.session.get(Team, team_id)
     if not team:
         return jsonify({'error': 'Team not found'}), 404
     
     # Check access
-    is_member = any(tm.team_id == team_id for tm in user.team_memberships)
-    if not is_member and not user.is_super_admin:
+    is_member = is_team_member(current_user_id, team_id)
+    if not is_member and not check_super_admin(current_user_id):
         return jsonify({'error': 'Access denied'}), 403
     
     # Get filter parameters
     status_filter = request.args.get('status')
     
-    query = Post.query.filter_by(team_id=team_id)
+    query = Post.query.options(selectinload(Post.media)).filter_by(team_id=team_id)
     
     if status_filter:
         query = query.filter_by(status=status_filter)
     
     posts = query.order_by(Post.created_at.desc()).all()
     
+    # Load approval info for all pending posts in one query
+    pending_ids = [post.id for post in posts if post.status == 'pending_approval']
+    approvals = {}
+    if pending_ids:
+        approvals = {
+            approval.post_id: approval
+            for approval in PostApproval.query.filter(
+                PostApproval.post_id.in_(pending_ids),
+                PostApproval.team_id == team_id
+            ).all()
+        }
+    
     # Include approval info for each post
     posts_data = []
     for post in posts:
         post_dict = post.to_dict()
         
-        # Get approval info if post is pending approval
-        if post.status == 'pending_approval':
-            approval = PostApproval.query.filter_by(post_id=post.id, team_id=team_id).first()
-            if approval:
-                post_dict['approval'] = approval.to_dict()
+        approval = approvals.get(post.id)
+        if approval:
+            post_dict['approval'] = approval.to_dict()
         
         posts_data.append(post_dict)
     
@@ -60,12 +139,12 @@ def get_team_posts(team_id):
 def send_for_approval(post_id):
     """Send a post for team leader approval."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = db.session.get(User, current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    post = Post.query.get(post_id)
+    post = db.session.get(Post, post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
     
@@ -102,6 +181,7 @@ def send_for_approval(post_id):
         post.status = 'pending_approval'
         
         db.session.add(approval)
+        User.bump_dashboard_version(post.user_id)
         db.session.commit()
         
         logger.info(f'Post {post_id} sent for approval by user {current_user_id}')
@@ -122,43 +202,15 @@ def send_for_approval(post_id):
 def approve_post(post_id):
     """Approve a post. Only team leader can approve."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
-    
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-    
-    post = Post.query.get(post_id)
-    if not post:
-        return jsonify({'error': 'Post not found'}), 404
-    
-    if post.status != 'pending_approval':
-        return jsonify({'error': 'Post is not pending approval'}), 400
-    
-    team_id = post.team_id
-    team_member = TeamMember.query.filter_by(
-        team_id=team_id,
-        user_id=current_user_id
-    ).first()
-    
-    # Check if user is team leader or super admin
-    is_leader = team_member and team_member.role == 'leader'
-    if not is_leader and not user.is_super_admin:
-        return jsonify({'error': 'Only team leaders can approve posts'}), 403
     
     data = request.get_json() or {}
     comments = data.get('comments', '')
     
     try:
-        # Update approval record
-        approval = PostApproval.query.filter_by(post_id=post_id, team_id=team_id).first()
-        if approval:
-            approval.status = 'approved'
-            approval.reviewed_by = current_user_id
-            approval.review_comments = comments
-            approval.reviewed_at = datetime.utcnow()
-        
         # Update post status to scheduled (or user can still change the schedule)
-        post.status = 'scheduled'
+        if not review_post(post_id, current_user_id, 'approved', comments, status='scheduled'):
+            db.session.rollback()
+            return review_failure(post_id, 'approve')
         
         db.session.commit()
         
@@ -166,7 +218,7 @@ def approve_post(post_id):
         
         return jsonify({
             'message': 'Post approved successfully',
-            'post': post.to_dict()
+            'post': load_post(post_id).to_dict()
         }), 200
     
     except Exception as e:
@@ -180,28 +232,6 @@ def approve_post(post_id):
 def reject_post(post_id):
     """Reject a post. Only team leader can reject."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
-    
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-    
-    post = Post.query.get(post_id)
-    if not post:
-        return jsonify({'error': 'Post not found'}), 404
-    
-    if post.status != 'pending_approval':
-        return jsonify({'error': 'Post is not pending approval'}), 400
-    
-    team_id = post.team_id
-    team_member = TeamMember.query.filter_by(
-        team_id=team_id,
-        user_id=current_user_id
-    ).first()
-    
-    # Check if user is team leader or super admin
-    is_leader = team_member and team_member.role == 'leader'
-    if not is_leader and not user.is_super_admin:
-        return jsonify({'error': 'Only team leaders can reject posts'}), 403
     
     data = request.get_json() or {}
     comments = data.get('comments', '')
@@ -210,17 +240,11 @@ def reject_post(post_id):
         return jsonify({'error': 'Rejection reason is required'}), 400
     
     try:
-        # Update approval record
-        approval = PostApproval.query.filter_by(post_id=post_id, team_id=team_id).first()
-        if approval:
-            approval.status = 'rejected'
-            approval.reviewed_by = current_user_id
-            approval.review_comments = comments
-            approval.reviewed_at = datetime.utcnow()
-        
         # Update post status to draft so user can edit
-        post.status = 'draft'
-        post.error_message = f'Rejected: {comments}'
+        if not review_post(post_id, current_user_id, 'rejected', comments,
+                           status='draft', error_message=f'Rejected: {comments}'):
+            db.session.rollback()
+            return review_failure(post_id, 'reject')
         
         db.session.commit()
         
@@ -228,7 +252,7 @@ def reject_post(post_id):
         
         return jsonify({
             'message': 'Post rejected',
-            'post': post.to_dict()
+            'post': load_post(post_id).to_dict()
         }), 200
     
     except Exception as e:
@@ -242,21 +266,17 @@ def reject_post(post_id):
 def get_post_approvals(post_id):
     """Get approval history for a post."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
-    
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
     
-    post = Post.query.get(post_id)
+    post = db.session.get(Post, post_id)
     if not post:
         return jsonify({'error': 'Post not found'}), 404
     
     # Check access
-    if post.user_id != current_user_id and not user.is_super_admin:
+    if post.user_id != current_user_id and not check_super_admin(current_user_id):
         # Check if user is in the same team
         team_id = post.team_id
         if team_id:
-            is_member = any(tm.team_id == team_id for tm in user.team_memberships)
+            is_member = is_team_member(current_user_id, team_id)
             if not is_member:
                 return jsonify({'error': 'Access denied'}), 403
     
@@ -1,11 +1,28 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Settings
+from flask import Blueprint, request, jsonify, make_response
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from functools import wraps
+from models import db, Settings
+from routes.admin_settings import check_super_admin
+from settings_cache import get_email_settings_map, get_settings_map, invalidate_settings_cache, settings_version
 import os
-from datetime import datetime
+import logging
 
+logger = logging.getLogger(__name__)
 settings_bp = Blueprint('settings', __name__, url_prefix='/api/settings')
 
+TRUTHY_VALUES = frozenset({'true', 'yes', '1'})
+
+# Returned for email settings that aren't stored
+EMAIL_SETTING_DEFAULTS = {
+    'mail_server': '',
+    'mail_port': 587,
+    'mail_use_tls': True,
+    'mail_username': '',
+    'mail_password': '',
+    'mail_from_email': 'noreply@postwave.com',
+    'mail_from_name': 'PostWave'
+}
+
 # Settings configuration with descriptions and types
 EDITABLE_SETTINGS = {
     'MAIL_SERVER': {'type': 'string', 'description': 'SMTP server address (e.g., smtp.gmail.com)', 'editable': True},
@@ -18,99 +35,149 @@ EDITABLE_SETTINGS = {
     'APP_HOST': {'type': 'string', 'description': 'Public URL for media access', 'editable': True},
 }
 
+# Environment fallbacks for settings not stored in the database, read once at
+# import. The environment doesn't change under a running process.
+ENV_SETTINGS = {key: os.getenv(key, '') for key in EDITABLE_SETTINGS}
+
+
+def boolean_setting(value):
+    """Normalize a boolean setting to 'True' or 'False'"""
+    if isinstance(value, bool):
+        return str(value)
+    return str(str(value).lower() in TRUTHY_VALUES)
+
+
+def integer_setting(value):
+    """Normalize an integer setting, raising ValueError for non-numbers"""
+    return str(int(value))
+
+
+# Value converters by setting type; each returns the string that gets stored
+SETTING_CONVERTERS = {
+    'boolean': boolean_setting,
+    'integer': integer_setting,
+    'string': str,
+}
+
+
+def save_settings(values):
+    """
+    Upsert {key: stored value} pairs for EDITABLE_SETTINGS keys and commit.
+
+    Returns the keys whose value changed. Rolling back on failure is left to
+    the caller so each endpoint can report its own error.
+    """
+    updated = Settings.upsert([
+        {
+            'key': key,
+            'value': value,
+            'setting_type': EDITABLE_SETTINGS[key]['type'],
+            'description': EDITABLE_SETTINGS[key]['description']
+        }
+        for key, value in values.items()
+    ])
+    if updated:
+        db.session.commit()
+        invalidate_settings_cache()
+    return updated
+
+
+@settings_bp.before_request
+def require_super_admin():
+    """
+    Restrict every settings route to super admins.
+
+    Runs once per request ahead of the view. The database decides rather
+    than the token's claim, so promotion and demotion apply immediately.
+    """
+    if request.method == 'OPTIONS':
+        # CORS preflight carries no token
+        return None
+    verify_jwt_in_request()
+    if not check_super_admin(int(get_jwt_identity())):
+        action = 'access' if request.method == 'GET' else 'update'
+        return jsonify({'error': f'Only super admins can {action} settings'}), 403
+    return None
+
+
+def settings_etag(f):
+    """
+    Tag settings GETs with the version of the loaded settings.
+
+    Clients revalidate on every use and get an empty 304 until the stored
+    settings change, whichever process wrote them.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        etag = f'settings-{settings_version()}'
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.max_age = 0
+        return response
+    return decorated_function
+
 
 @settings_bp.route('/', methods=['GET'])
-@jwt_required()
+@settings_etag
 def get_settings():
     """Get all editable settings. Super admin only."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_super_admin:
-        return jsonify({'error': 'Only super admins can access settings'}), 403
-    
-    settings = Settings.query.filter_by(editable=True).all()
+    stored = get_settings_map()
     
     # Include environment variable values as fallback
     result = {}
     for key in EDITABLE_SETTINGS.keys():
-        setting = Settings.query.filter_by(key=key).first()
+        in_database = key in stored
         
         # Use database value if set, otherwise use environment variable
-        value = setting.value if setting else os.getenv(key, '')
+        value = stored[key] if in_database else ENV_SETTINGS[key]
         
         result[key] = {
             'value': value,
             'type': EDITABLE_SETTINGS[key]['type'],
             'description': EDITABLE_SETTINGS[key]['description'],
-            'source': 'database' if setting else 'environment'
+            'source': 'database' if in_database else 'environment'
         }
     
     return jsonify(result), 200
 
 
 @settings_bp.route('/', methods=['PUT'])
-@jwt_required()
 def update_settings():
     """Update settings. Super admin only."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_super_admin:
-        return jsonify({'error': 'Only super admins can update settings'}), 403
-    
     data = request.get_json()
     
     if not data:
         return jsonify({'error': 'No data provided'}), 400
     
-    updated = []
+    values = {}
     errors = []
     
     for key, value in data.items():
         # Validate key
-        if key not in EDITABLE_SETTINGS:
+        config = EDITABLE_SETTINGS.get(key)
+        if config is None:
             errors.append(f'Unknown setting: {key}')
             continue
         
         # Validate and convert value based on type
-        setting_type = EDITABLE_SETTINGS[key]['type']
-        
         try:
-            if setting_type == 'boolean':
-                if isinstance(value, bool):
-                    converted_value = str(value)
-                else:
-                    converted_value = str(value).lower() in ('true', 'yes', '1')
-                    converted_value = str(converted_value)
-            elif setting_type == 'integer':
-                converted_value = str(int(value))
-            else:  # string
-                converted_value = str(value)
+            values[key] = SETTING_CONVERTERS[config['type']](value)
         except (ValueError, TypeError) as e:
             errors.append(f'Invalid value for {key}: {str(e)}')
             continue
-        
-        # Update or create setting
-        setting = Settings.query.filter_by(key=key).first()
-        
-        if not setting:
-            setting = Settings(
-                key=key,
-                value=converted_value,
-                setting_type=setting_type,
-                description=EDITABLE_SETTINGS[key]['description'],
-                editable=True
-            )
-            db.session.add(setting)
-        else:
-            setting.value = converted_value
-            setting.updated_at = datetime.utcnow()
-        
-        updated.append(key)
     
-    if updated:
-        db.session.commit()
+    # Insert new keys and update existing ones in a single statement
+    try:
+        updated = save_settings(values)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Failed to save settings: {str(e)}'}), 500
     
     return jsonify({
         'success': True,
@@ -121,34 +188,23 @@ def update_settings():
 
 
 @settings_bp.route('/initialize', methods=['POST'])
-@jwt_required()
 def initialize_settings():
     """Initialize settings from environment variables. Super admin only."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_super_admin:
-        return jsonify({'error': 'Only super admins can initialize settings'}), 403
-    
-    initialized = []
-    
-    for key, config in EDITABLE_SETTINGS.items():
-        # Check if setting already exists
-        setting = Settings.query.filter_by(key=key).first()
-        
-        if not setting:
-            env_value = os.getenv(key, '')
-            setting = Settings(
-                key=key,
-                value=env_value,
-                setting_type=config['type'],
-                description=config['description'],
-                editable=config['editable']
-            )
-            db.session.add(setting)
-            initialized.append(key)
+    # Only keys that aren't stored yet are written
+    initialized = Settings.upsert([
+        {
+            'key': key,
+            'value': ENV_SETTINGS[key],
+            'setting_type': config['type'],
+            'description': config['description'],
+            'editable': config['editable']
+        }
+        for key, config in EDITABLE_SETTINGS.items()
+    ], update=False)
     
-    db.session.commit()
+    if initialized:
+        db.session.commit()
+        invalidate_settings_cache()
     
     return jsonify({
         'success': True,
@@ -158,101 +214,58 @@ def initialize_settings():
 
 
 @settings_bp.route('/<key>', methods=['GET'])
-@jwt_required()
+@settings_etag
 def get_setting(key):
     """Get a specific setting. Super admin only."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_super_admin:
-        return jsonify({'error': 'Only super admins can access settings'}), 403
-    
     if key not in EDITABLE_SETTINGS:
         return jsonify({'error': 'Unknown setting'}), 404
     
-    setting = Settings.query.filter_by(key=key).first()
-    value = setting.value if setting else os.getenv(key, '')
+    stored = get_settings_map()
+    in_database = key in stored
+    value = stored[key] if in_database else ENV_SETTINGS[key]
     
     return jsonify({
         'key': key,
         'value': value,
         'type': EDITABLE_SETTINGS[key]['type'],
         'description': EDITABLE_SETTINGS[key]['description'],
-        'source': 'database' if setting else 'environment'
+        'source': 'database' if in_database else 'environment'
     }), 200
 
 
 @settings_bp.route('/email', methods=['GET'])
-@jwt_required()
+@settings_etag
 def get_email_settings():
     """Get email (SMTP) settings. Super admin only."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_super_admin:
-        return jsonify({'error': 'Only super admins can view settings'}), 403
-    
     try:
         settings = {}
         
-        # Define email settings keys (both uppercase from onboarding and lowercase for consistency)
-        email_keys = [
-            'MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_TLS', 'MAIL_USERNAME', 
-            'MAIL_PASSWORD', 'MAIL_FROM_EMAIL', 'MAIL_FROM_NAME',
-            'mail_server', 'mail_port', 'mail_use_tls', 'mail_username',
-            'mail_password', 'mail_from_email', 'mail_from_name'
-        ]
-        
-        # Get from database
-        for key in email_keys:
-            setting = Settings.query.filter_by(key=key).first()
-            if setting:
-                value = setting.value
-                # Convert port to integer
-                if 'port' in key.lower():
-                    value = int(value) if value else 587
-                # Convert boolean string
-                elif 'tls' in key.lower():
-                    value = value.lower() == 'true' if isinstance(value, str) else value
-                # Store with lowercase key for consistency
-                normalized_key = key.lower()
-                settings[normalized_key] = value
+        for key, value in get_email_settings_map().items():
+            # Convert port to integer
+            if key == 'mail_port':
+                value = int(value) if value else 587
+            # Convert boolean string
+            elif key == 'mail_use_tls':
+                value = value.lower() == 'true' if isinstance(value, str) else value
+            settings[key] = value
         
         # Return with lowercase keys
-        return jsonify({
-            'mail_server': settings.get('mail_server', ''),
-            'mail_port': settings.get('mail_port', 587),
-            'mail_use_tls': settings.get('mail_use_tls', True),
-            'mail_username': settings.get('mail_username', ''),
-            'mail_password': settings.get('mail_password', ''),
-            'mail_from_email': settings.get('mail_from_email', 'noreply@postwave.com'),
-            'mail_from_name': settings.get('mail_from_name', 'PostWave')
-        }), 200
+        return jsonify({**EMAIL_SETTING_DEFAULTS, **settings}), 200
     
     except Exception as e:
-        logger = logging.getLogger(__name__)
         logger.error(f'Failed to get email settings: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to get email settings'}), 500
 
 
 @settings_bp.route('/email', methods=['POST'])
-@jwt_required()
 def update_email_settings():
     """Update email (SMTP) settings. Super admin only. Used during onboarding."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_super_admin:
-        return jsonify({'error': 'Only super admins can update settings'}), 403
-    
     data = request.get_json()
     
     if not data:
         return jsonify({'error': 'No email configuration data provided'}), 400
     
     # Log the received data for debugging
-    import logging
-    logger = logging.getLogger(__name__)
     logger.info(f'Email settings data received: {data}')
     
     # Validate required fields
@@ -280,24 +293,8 @@ def update_email_settings():
         logger.error(f'Email settings conversion error: {error_msg}')
         return jsonify({'error': error_msg}), 422
     
-    for key, value in email_settings.items():
-        setting = Settings.query.filter_by(key=key).first()
-        
-        if not setting:
-            setting = Settings(
-                key=key,
-                value=value,
-                setting_type=EDITABLE_SETTINGS[key]['type'],
-                description=EDITABLE_SETTINGS[key]['description'],
-                editable=True
-            )
-            db.session.add(setting)
-        else:
-            setting.value = value
-            setting.updated_at = datetime.utcnow()
-    
     try:
-        db.session.commit()
+        save_settings(email_settings)
         logger.info('Email settings saved successfully')
     except Exception as e:
         db.session.rollback()
@@ -312,15 +309,8 @@ def update_email_settings():
 
 
 @settings_bp.route('/app-url', methods=['POST'])
-@jwt_required()
 def update_app_url():
     """Update application URL. Super admin only. Used during onboarding."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if not user or not user.is_super_admin:
-        return jsonify({'error': 'Only super admins can update settings'}), 403
-    
     data = request.get_json()
     
     if not data:
@@ -332,22 +322,7 @@ def update_app_url():
         return jsonify({'error': 'Application URL is required and cannot be empty'}), 422
     
     try:
-        setting = Settings.query.filter_by(key='APP_HOST').first()
-        
-        if not setting:
-            setting = Settings(
-                key='APP_HOST',
-                value=app_url,
-                setting_type='string',
-                description=EDITABLE_SETTINGS['APP_HOST']['description'],
-                editable=True
-            )
-            db.session.add(setting)
-        else:
-            setting.value = app_url
-            setting.updated_at = datetime.utcnow()
-        
-        db.session.commit()
+        save_settings({'APP_HOST': app_url})
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Failed to save application URL: {str(e)}'}), 500
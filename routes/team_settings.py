@@ -1,6 +1,8 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload, selectinload
 from models import db, User, Team, TeamMember, ActivityLog, Invitation, Post
+from routes.admin_settings import capture_client_info, log_activity
 from datetime import datetime, timedelta
 import logging
 import secrets
@@ -9,35 +11,28 @@ from functools import wraps
 logger = logging.getLogger(__name__)
 team_settings_bp = Blueprint('team_settings', __name__, url_prefix='/api/team-settings')
 
-
-def log_activity(user_id, action_type, description, resource_type=None, resource_id=None, metadata=None, team_id=None):
-    """Helper function to log activities"""
-    try:
-        log_entry = ActivityLog(
-            team_id=team_id,
-            user_id=user_id,
-            action_type=action_type,
-            description=description,
-            resource_type=resource_type,
-            resource_id=resource_id,
-            extra_data=metadata,
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent', '')
-        )
-        db.session.add(log_entry)
-        db.session.commit()
-    except Exception as e:
-        logger.error(f'Failed to log activity: {str(e)}')
+# Activity logs share one writer, and one way of reading the client's address
+# and user agent, with the admin settings routes
+team_settings_bp.before_request(capture_client_info)
 
 
-def get_user_team_role(user_id, team_id):
-    """Get user's role in a team"""
-    membership = TeamMember.query.filter_by(user_id=user_id, team_id=team_id).first()
-    return membership.role if membership else None
+def load_team_membership(user_id, team_id):
+    """Load a user's membership in a team together with the team, in one query"""
+    return db.session.query(TeamMember, Team).join(
+        Team, Team.id == TeamMember.team_id
+    ).filter(
+        TeamMember.user_id == user_id,
+        TeamMember.team_id == team_id
+    ).first()
 
 
 def require_team_role(*allowed_roles):
-    """Decorator to check if user has required role in team"""
+    """
+    Decorator to check if user has required role in team.
+
+    The membership and team are stored on g.team_membership and g.team for
+    the view.
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -47,14 +42,17 @@ def require_team_role(*allowed_roles):
             if not team_id:
                 return jsonify({'error': 'Team ID required'}), 400
             
-            role = get_user_team_role(current_user_id, team_id)
+            row = load_team_membership(current_user_id, team_id)
             
-            if not role:
+            if not row:
                 return jsonify({'error': 'Not a member of this team'}), 403
             
-            if allowed_roles and role not in allowed_roles:
+            membership, team = row
+            if allowed_roles and membership.role not in allowed_roles:
                 return jsonify({'error': f'Insufficient permissions - requires {allowed_roles}'}), 403
             
+            g.team_membership = membership
+            g.team = team
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -68,17 +66,15 @@ def require_team_role(*allowed_roles):
 def get_team_settings(team_id):
     """Get team settings"""
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
+        team = g.team
         
         return jsonify({
             'id': team.id,
             'name': team.name,
             'description': team.description,
             'instagram_username': team.instagram_username,
-            'instagram_connected': bool(team.instagram_account_id),
-            'created_at': team.created_at.isoformat()
+            'instagram_connected': team.instagram_connected,
+            'created_at': team.created_at
         }), 200
     
     except Exception as e:
@@ -94,17 +90,15 @@ def get_team_settings(team_id):
 def get_instagram_settings(team_id):
     """Get Instagram API settings for team"""
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
+        team = g.team
         
         current_user_id = int(get_jwt_identity())
         
         return jsonify({
             'instagram_username': team.instagram_username,
             'instagram_profile_picture': team.instagram_profile_picture,
-            'instagram_connected': bool(team.instagram_account_id),
-            'token_expires_at': team.token_expires_at.isoformat() if team.token_expires_at else None
+            'instagram_connected': team.instagram_connected,
+            'token_expires_at': team.token_expires_at
         }), 200
     
     except Exception as e:
@@ -120,9 +114,7 @@ def disconnect_instagram(team_id):
     current_user_id = int(get_jwt_identity())
     
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
+        team = g.team
         
         old_username = team.instagram_username
         team.instagram_account_id = None
@@ -130,7 +122,6 @@ def disconnect_instagram(team_id):
         team.instagram_username = None
         team.instagram_profile_picture = None
         team.token_expires_at = None
-        db.session.commit()
         
         log_activity(
             current_user_id,
@@ -140,10 +131,12 @@ def disconnect_instagram(team_id):
             resource_id=team_id,
             team_id=team_id
         )
+        db.session.commit()
         
         return jsonify({'message': 'Instagram account disconnected'}), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to disconnect Instagram: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to disconnect Instagram'}), 500
 
@@ -154,22 +147,20 @@ def disconnect_instagram(team_id):
 def fetch_team_profile_picture(team_id):
     """Fetch and update team's Instagram profile picture"""
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
+        team = g.team
         
         if not team.instagram_account_id or not team.instagram_access_token:
             return jsonify({'error': 'Instagram not connected'}), 400
         
-        from instagram_api import InstagramAPI
-        ig_api = InstagramAPI()
+        from instagram_api import shared_api as ig_api
         
         # Fetch account info including profile picture
         account_info = ig_api.get_account_info(team.instagram_account_id, team.instagram_access_token)
         
         if account_info and account_info.get('profile_picture_url'):
-            team.instagram_profile_picture = account_info['profile_picture_url']
-            db.session.commit()
+            if team.instagram_profile_picture != account_info['profile_picture_url']:
+                team.instagram_profile_picture = account_info['profile_picture_url']
+                db.session.commit()
             return jsonify({
                 'instagram_profile_picture': team.instagram_profile_picture,
                 'message': 'Profile picture fetched successfully'
@@ -191,12 +182,13 @@ def fetch_team_profile_picture(team_id):
 def get_team_members(team_id):
     """Get team members"""
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
+        # to_dict() reads each member's user, so load them all in one query
+        members = TeamMember.query.options(
+            selectinload(TeamMember.user)
+        ).filter_by(team_id=team_id).all()
         
         return jsonify({
-            'members': [m.to_dict() for m in team.members]
+            'members': [m.to_dict() for m in members]
         }), 200
     
     except Exception as e:
@@ -212,11 +204,9 @@ def update_team_member(team_id, user_id):
     current_user_id = int(get_jwt_identity())
     
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
-        
-        member = TeamMember.query.filter_by(team_id=team_id, user_id=user_id).first()
+        member = TeamMember.query.options(
+            joinedload(TeamMember.user)
+        ).filter_by(team_id=team_id, user_id=user_id).first()
         if not member:
             return jsonify({'error': 'Team member not found'}), 404
         
@@ -239,8 +229,6 @@ def update_team_member(team_id, user_id):
         if 'requires_approval' in data:
             member.requires_approval = data['requires_approval']
         
-        db.session.commit()
-        
         log_activity(
             current_user_id,
             'member_updated',
@@ -250,6 +238,7 @@ def update_team_member(team_id, user_id):
             team_id=team_id,
             metadata={'old_role': old_role, 'new_role': member.role}
         )
+        db.session.commit()
         
         return jsonify({
             'message': 'Team member updated',
@@ -257,6 +246,7 @@ def update_team_member(team_id, user_id):
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to update team member: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to update team member'}), 500
 
@@ -270,22 +260,18 @@ def remove_team_member(team_id, user_id):
     
     # Prevent removing self as owner
     if current_user_id == user_id:
-        current_role = get_user_team_role(current_user_id, team_id)
-        if current_role == 'owner':
+        if g.team_membership.role == 'owner':
             return jsonify({'error': 'Cannot remove yourself as team owner'}), 400
     
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
-        
-        member = TeamMember.query.filter_by(team_id=team_id, user_id=user_id).first()
+        member = TeamMember.query.options(
+            joinedload(TeamMember.user)
+        ).filter_by(team_id=team_id, user_id=user_id).first()
         if not member:
             return jsonify({'error': 'Team member not found'}), 404
         
         member_email = member.user.email
         db.session.delete(member)
-        db.session.commit()
         
         log_activity(
             current_user_id,
@@ -295,10 +281,12 @@ def remove_team_member(team_id, user_id):
             resource_id=user_id,
             team_id=team_id
         )
+        db.session.commit()
         
         return jsonify({'message': f'Member {member_email} removed from team'}), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to remove team member: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to remove team member'}), 500
 
@@ -311,10 +299,6 @@ def remove_team_member(team_id, user_id):
 def get_pending_invitations(team_id):
     """Get pending invitations for team"""
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
-        
         invitations = Invitation.query.filter_by(
             team_id=team_id,
             status='pending'
@@ -326,8 +310,8 @@ def get_pending_invitations(team_id):
                     'id': i.id,
                     'email': i.email,
                     'status': i.status,
-                    'created_at': i.created_at.isoformat(),
-                    'expires_at': i.expires_at.isoformat()
+                    'created_at': i.created_at,
+                    'expires_at': i.expires_at
                 } for i in invitations
             ]
         }), 200
@@ -356,12 +340,21 @@ def resend_invitation(team_id, invitation_id):
         invitation.expires_at = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         from datetime import timedelta
         invitation.expires_at += timedelta(days=7)
+        
+        log_activity(
+            current_user_id,
+            'invitation_resent',
+            f'Resent invitation to {invitation.email}',
+            resource_type='invitation',
+            resource_id=invitation_id,
+            team_id=team_id
+        )
         db.session.commit()
         
         # Send email invitation again
         try:
             from email_utils import EmailService, get_app_url
-            team = Team.query.get(team_id)
+            team = g.team
             inviter = User.query.get(current_user_id)
             app_url = get_app_url()
             success, message = EmailService.send_invitation_email(
@@ -376,18 +369,10 @@ def resend_invitation(team_id, invitation_id):
         except Exception as e:
             logger.error(f'Error resending invitation email: {str(e)}', exc_info=True)
         
-        log_activity(
-            current_user_id,
-            'invitation_resent',
-            f'Resent invitation to {invitation.email}',
-            resource_type='invitation',
-            resource_id=invitation_id,
-            team_id=team_id
-        )
-        
         return jsonify({'message': 'Invitation resent'}), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to resend invitation: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to resend invitation'}), 500
 
@@ -406,7 +391,6 @@ def cancel_invitation(team_id, invitation_id):
         
         email = invitation.email
         db.session.delete(invitation)
-        db.session.commit()
         
         log_activity(
             current_user_id,
@@ -416,10 +400,12 @@ def cancel_invitation(team_id, invitation_id):
             resource_id=invitation_id,
             team_id=team_id
         )
+        db.session.commit()
         
         return jsonify({'message': 'Invitation cancelled'}), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to cancel invitation: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to cancel invitation'}), 500
 
@@ -432,33 +418,25 @@ def cancel_invitation(team_id, invitation_id):
 def get_team_logs(team_id):
     """Get team activity logs"""
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
-        
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 50, type=int)
         action_type = request.args.get('action_type', '', type=str)
         search = request.args.get('search', '', type=str)
         
-        query = ActivityLog.query.filter_by(team_id=team_id)
+        criteria = [ActivityLog.team_id == team_id]
         
         if action_type:
-            query = query.filter_by(action_type=action_type)
+            criteria.append(ActivityLog.action_type == action_type)
         
         if search:
-            query = query.filter(ActivityLog.description.ilike(f'%{search}%'))
+            criteria.append(ActivityLog.description.ilike(f'%{search}%'))
         
-        logs = query.order_by(ActivityLog.created_at.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        logs, total, pages = ActivityLog.feed(*criteria, page=page, per_page=per_page)
         
         return jsonify({
-            'logs': [log.to_dict() for log in logs.items],
-            'total': logs.total,
-            'pages': logs.pages,
+            'logs': logs,
+            'total': total,
+            'pages': pages,
             'current_page': page
         }), 200
     
@@ -477,9 +455,7 @@ def connect_team_instagram(team_id):
     current_user_id = int(get_jwt_identity())
     
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
+        team = g.team
         
         data = request.get_json()
         
@@ -498,18 +474,22 @@ def connect_team_instagram(team_id):
         # Get long-lived token (will use token directly if app credentials not available)
         token_data = ig_api.get_long_lived_token(data['access_token'])
         
-        # Get Instagram account info
+        # Get Instagram account info. Page and token lookups expand the
+        # account fields in the same call, so get_account_info is only needed
+        # for a directly provided account ID.
         ig_account_id = None
+        account_info = {}
         if data.get('instagram_account_id'):
             ig_account_id = data['instagram_account_id']
         elif data.get('page_id'):
             page_id = data['page_id']
             account_info = ig_api.get_page_instagram_account(page_id, token_data['access_token'])
-            ig_account_id = account_info.get('instagram_business_account_id')
+            ig_account_id = account_info.get('id')
         else:
             # Try to auto-detect from token
             try:
-                ig_account_id = ig_api.get_instagram_account_id_from_token(token_data['access_token'])
+                account_info = ig_api.find_instagram_account(token_data['access_token'])
+                ig_account_id = account_info.get('id')
             except Exception as e:
                 logger.warning(f'Auto-detection failed: {str(e)}')
         
@@ -517,7 +497,8 @@ def connect_team_instagram(team_id):
             return jsonify({'error': 'Could not find Instagram account. Please provide instagram_account_id or ensure your account is connected to a Facebook Page.'}), 400
         
         # Get account info
-        account_info = ig_api.get_account_info(ig_account_id, token_data['access_token'])
+        if 'username' not in account_info:
+            account_info = ig_api.get_account_info(ig_account_id, token_data['access_token'])
         
         # Update team with Instagram credentials
         team.instagram_account_id = ig_account_id
@@ -534,8 +515,6 @@ def connect_team_instagram(team_id):
         else:
             team.token_expires_at = datetime.utcnow() + timedelta(days=60)  # Default 60 days
         
-        db.session.commit()
-        
         log_activity(
             current_user_id,
             'instagram_connected',
@@ -545,6 +524,7 @@ def connect_team_instagram(team_id):
             team_id=team_id,
             metadata={'instagram_username': team.instagram_username}
         )
+        db.session.commit()
         
         return jsonify({
             'message': 'Instagram connected successfully',
@@ -553,6 +533,7 @@ def connect_team_instagram(team_id):
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         error_msg = str(e)
         logger.error(f'Failed to connect Instagram for team: {error_msg}', exc_info=True)
         print(f'[ERROR] Instagram connect failed: {error_msg}')  # Also print to console
@@ -572,10 +553,6 @@ def transfer_ownership(team_id):
     current_user_id = int(get_jwt_identity())
     
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
-        
         data = request.get_json()
         new_owner_id = data.get('new_owner_id')
         
@@ -588,16 +565,12 @@ def transfer_ownership(team_id):
             return jsonify({'error': 'User is not a member of this team'}), 404
         
         # Get current owner's membership
-        current_owner = TeamMember.query.filter_by(team_id=team_id, user_id=current_user_id).first()
-        if not current_owner:
-            return jsonify({'error': 'Current user is not a member of this team'}), 404
+        current_owner = g.team_membership
         
         # Update roles
         current_owner.role = 'manager'
         new_owner_member.role = 'owner'
         
-        db.session.commit()
-        
         # Log activity
         new_owner_user = User.query.get(new_owner_id)
         log_activity(
@@ -609,6 +582,7 @@ def transfer_ownership(team_id):
             team_id=team_id,
             metadata={'new_owner_id': new_owner_id, 'new_owner_email': new_owner_user.email}
         )
+        db.session.commit()
         
         return jsonify({
             'message': 'Team ownership transferred successfully',
@@ -617,6 +591,7 @@ def transfer_ownership(team_id):
         }), 200
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to transfer ownership: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to transfer ownership'}), 500
 
@@ -631,9 +606,7 @@ def invite_team_member(team_id):
     current_user_id = int(get_jwt_identity())
     
     try:
-        team = Team.query.get(team_id)
-        if not team:
-            return jsonify({'error': 'Team not found'}), 404
+        team = g.team
         
         data = request.get_json()
         email = data.get('email', '').lower().strip()
@@ -675,7 +648,8 @@ def invite_team_member(team_id):
         )
         
         db.session.add(invitation)
-        db.session.commit()
+        # Assigns invitation.id for the log entry
+        db.session.flush()
         
         # Log activity
         inviter = User.query.get(current_user_id)
@@ -688,6 +662,7 @@ def invite_team_member(team_id):
             team_id=team_id,
             metadata={'invited_email': email}
         )
+        db.session.commit()
         
         # Send email invitation
         try:
@@ -710,11 +685,12 @@ def invite_team_member(team_id):
             'invitation': {
                 'id': invitation.id,
                 'email': email,
-                'created_at': invitation.created_at.isoformat(),
-                'expires_at': invitation.expires_at.isoformat()
+                'created_at': invitation.created_at,
+                'expires_at': invitation.expires_at
             }
         }), 201
     
     except Exception as e:
+        db.session.rollback()
         logger.error(f'Failed to invite team member: {str(e)}', exc_info=True)
         return jsonify({'error': 'Failed to send invitation'}), 500
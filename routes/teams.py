@@ -4,6 +4,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User, Team, TeamMember, Invitation, Post, PostApproval, Settings
 from email_utils import EmailService
+from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
 import secrets
 import logging
@@ -52,18 +53,24 @@ def setup_admin():
         user.set_password(data['password'])
         
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
+        
+        # Build the response from the flushed row; after commit the instance is
+        # expired and reading it would cost another SELECT
+        user_data = user.to_dict()
         
         # Generate JWT tokens for immediate authentication
         from flask_jwt_extended import create_access_token, create_refresh_token
         access_token = create_access_token(identity=str(user.id))
         refresh_token = create_refresh_token(identity=str(user.id))
         
-        logger.info(f'Super admin created: {user.email}')
+        db.session.commit()
+        
+        logger.info(f'Super admin created: {user_data["email"]}')
         
         return jsonify({
             'message': 'Super admin created successfully',
-            'user': user.to_dict(),
+            'user': user_data,
             'access_token': access_token,
             'refresh_token': refresh_token
         }), 201
@@ -79,7 +86,10 @@ def setup_admin():
 def get_teams():
     """Get all teams for current user or all teams if super admin."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = User.query.options(
+        selectinload(User.team_memberships).joinedload(TeamMember.team)
+        .selectinload(Team.members).joinedload(TeamMember.user)
+    ).get(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -87,7 +97,7 @@ def get_teams():
     try:
         if user.is_super_admin:
             # Super admin sees all teams
-            teams = Team.query.all()
+            teams = Team.query.options(selectinload(Team.members).joinedload(TeamMember.user)).all()
         else:
             # Regular user sees only their teams
             teams = [tm.team for tm in user.team_memberships]
@@ -106,7 +116,7 @@ def get_teams():
 def create_team():
     """Create a new team. Only super admin or team leaders can create teams."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = User.query.options(selectinload(User.team_memberships)).get(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -159,12 +169,12 @@ def create_team():
 def get_team(team_id):
     """Get team details. Only members or super admin can view."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = User.query.options(selectinload(User.team_memberships)).get(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    team = Team.query.get(team_id)
+    team = Team.query.options(selectinload(Team.members).joinedload(TeamMember.user)).get(team_id)
     if not team:
         return jsonify({'error': 'Team not found'}), 404
     
@@ -226,7 +236,7 @@ def update_team(team_id):
 def get_team_members(team_id):
     """Get team members. Only team members or super admin can view."""
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = User.query.options(selectinload(User.team_memberships)).get(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -236,7 +246,7 @@ def get_team_members(team_id):
     if not is_member and not user.is_super_admin:
         return jsonify({'error': 'Access denied'}), 403
     
-    members = TeamMember.query.filter_by(team_id=team_id).all()
+    members = TeamMember.query.options(selectinload(TeamMember.user)).filter_by(team_id=team_id).all()
     
     return jsonify({
         'members': [m.to_dict() for m in members]
@@ -473,7 +483,7 @@ def get_invitation_details(token):
             'id': team.id,
             'name': team.name
         } if team else None,
-        'expires_at': invitation.expires_at.isoformat()
+        'expires_at': invitation.expires_at
     }), 200
 
 
@@ -497,8 +507,12 @@ def accept_invitation(token):
         return jsonify({'error': 'Invitation has expired'}), 400
     
     try:
-        # Check if user already exists
-        existing_user = User.query.filter_by(email=invitation.email).first()
+        # Look up the user and any existing membership of this team in one query
+        existing = db.session.query(User, TeamMember).outerjoin(
+            TeamMember,
+            (TeamMember.user_id == User.id) & (TeamMember.team_id == invitation.team_id)
+        ).filter(User.email == invitation.email).first()
+        existing_user, existing_member = existing if existing else (None, None)
         
         if existing_user:
             # User exists, just add to team
@@ -518,11 +532,6 @@ def accept_invitation(token):
             db.session.flush()
         
         # Add to team
-        existing_member = TeamMember.query.filter_by(
-            team_id=invitation.team_id,
-            user_id=user.id
-        ).first()
-        
         if not existing_member:
             team_member = TeamMember(
                 team_id=invitation.team_id,
@@ -535,20 +544,23 @@ def accept_invitation(token):
         # Mark invitation as accepted
         invitation.status = 'accepted'
         
-        db.session.commit()
+        # Build the response before commit expires the user instance
+        user_data = user.to_dict()
         
         # Generate JWT tokens for auto-login
         from flask_jwt_extended import create_access_token, create_refresh_token
         access_token = create_access_token(identity=str(user.id))
         refresh_token = create_refresh_token(identity=str(user.id))
         
-        logger.info(f'Invitation accepted by {user.email}')
+        db.session.commit()
+        
+        logger.info(f'Invitation accepted by {user_data["email"]}')
         
         return jsonify({
             'message': 'Invitation accepted successfully',
             'access_token': access_token,
             'refresh_token': refresh_token,
-            'user': user.to_dict()
+            'user': user_data
         }), 200
     
     except Exception as e:
@@ -46,9 +46,9 @@ def get_profile():
             'id': user.id,
             'name': user.name,
             'email': user.email,
-            'created_at': user.created_at.isoformat(),
+            'created_at': user.created_at,
             'is_super_admin': user.is_super_admin,
-            'instagram_connected': bool(user.instagram_account_id),
+            'instagram_connected': user.instagram_connected,
             'instagram_username': user.instagram_username
         }), 200
     
@@ -225,24 +225,20 @@ def get_user_logs():
         action_type = request.args.get('action_type', '', type=str)
         search = request.args.get('search', '', type=str)
         
-        query = ActivityLog.query.filter_by(user_id=current_user_id)
+        criteria = [ActivityLog.user_id == current_user_id]
         
         if action_type:
-            query = query.filter_by(action_type=action_type)
+            criteria.append(ActivityLog.action_type == action_type)
         
         if search:
-            query = query.filter(ActivityLog.description.ilike(f'%{search}%'))
+            criteria.append(ActivityLog.description.ilike(f'%{search}%'))
         
-        logs = query.order_by(ActivityLog.created_at.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        logs, total, pages = ActivityLog.feed(*criteria, page=page, per_page=per_page)
         
         return jsonify({
-            'logs': [log.to_dict() for log in logs.items],
-            'total': logs.total,
-            'pages': logs.pages,
+            'logs': logs,
+            'total': total,
+            'pages': pages,
             'current_page': page
         }), 200
     
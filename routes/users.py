@@ -1,7 +1,8 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, Post, Team
-from instagram_api import InstagramAPI
+from models import db, User, Post, Team, TeamMember
+from sqlalchemy.orm import selectinload
+from instagram_api import shared_api as ig_api
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,7 +31,9 @@ def get_stats():
     Get user statistics including both PostWave and Instagram posts.
     """
     current_user_id = int(get_jwt_identity())
-    user = User.query.get(current_user_id)
+    user = User.query.options(
+        selectinload(User.team_memberships).joinedload(TeamMember.team)
+    ).get(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -49,7 +52,6 @@ def get_stats():
         if team_member:
             team = team_member.team
             if team and team.instagram_account_id and team.instagram_access_token:
-                ig_api = InstagramAPI()
                 ig_posts, _ = ig_api.get_media_list_with_cache(
                     team.instagram_access_token,
                     team.instagram_account_id,
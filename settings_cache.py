@@ -0,0 +1,110 @@
+"""
+In-process cache for the Settings table.
+
+Settings are read on most admin and email code paths but change rarely, so the
+whole key/value map is loaded with a single query and reused until it expires
+or a write invalidates it.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from sqlalchemy import event
+from models import db, Settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = 300  # seconds
+
+# Email settings are stored lowercase; onboarding wrote the uppercase variants
+EMAIL_SETTING_KEYS = (
+    'mail_server', 'mail_port', 'mail_use_tls', 'mail_username',
+    'mail_password', 'mail_from_email', 'mail_from_name'
+)
+
+_lock = threading.Lock()
+_values = None
+_version = None
+_expires_at = 0.0
+_generation = 0
+# Keeps versions from one process run from matching those of the next
+_run_id = uuid.uuid4().hex[:8]
+
+
+def _load_settings():
+    """Get the cached (values, version) pair, reloading it once expired"""
+    global _values, _version, _expires_at
+
+    now = time.monotonic()
+    with _lock:
+        if _values is not None and _expires_at > now:
+            return _values, _version
+        generation = _generation
+
+    values = {key: value for key, value in db.session.query(Settings.key, Settings.value).all()}
+    # Derived from the contents, so rows written by other processes change it too
+    digest = hashlib.sha1(repr(sorted(values.items())).encode()).hexdigest()[:16]
+    version = f'{_run_id}-{digest}'
+
+    with _lock:
+        # Don't store a map that was loaded while a write invalidated the cache
+        if generation == _generation:
+            _values = values
+            _version = version
+            _expires_at = now + CACHE_TTL
+    return values, version
+
+
+def get_settings_map():
+    """
+    Get every stored setting as a {key: value} dict.
+
+    The returned dict is shared between callers and must not be modified.
+    """
+    return _load_settings()[0]
+
+
+def get_setting(key, default=None):
+    """Get a single setting value, or default if the key is not stored"""
+    return get_settings_map().get(key, default)
+
+
+def get_email_settings_map():
+    """
+    Get the stored email settings as a {lowercase key: value} dict.
+
+    A lowercase key wins over its uppercase onboarding variant. Every reader
+    of email settings goes through here so they agree on which row counts.
+    """
+    stored = get_settings_map()
+    values = {}
+    for key in EMAIL_SETTING_KEYS:
+        for candidate in (key, key.upper()):
+            if candidate in stored:
+                values[key] = stored[candidate]
+                break
+    return values
+
+
+def settings_version():
+    """Opaque token that changes whenever the stored settings do"""
+    return _load_settings()[1]
+
+
+def invalidate_settings_cache():
+    """Drop the cached settings so the next read reloads them"""
+    global _values, _version, _generation
+    with _lock:
+        _values = None
+        _version = None
+        _generation += 1
+
+
+@event.listens_for(Settings, 'after_insert')
+@event.listens_for(Settings, 'after_update')
+@event.listens_for(Settings, 'after_delete')
+def _invalidate_on_write(mapper, connection, target):
+    """Catch ORM writes that don't invalidate explicitly"""
+    invalidate_settings_cache()
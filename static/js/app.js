@@ -2265,8 +2265,17 @@ async function apiCall(endpoint, options = {}) {
         throw new Error('Unauthorized');
     }
     
-    // Check if response indicates dashboard cache should be invalidated
-    if (response.headers.get('X-Invalidate-Dashboard-Cache') === 'true') {
+    // Drop cached dashboard data when the server's version moves on
+    const dashboardVersion = response.headers.get('X-Dashboard-Version');
+    if (dashboardVersion !== null) {
+        const cachedVersion = localStorage.getItem('dashboard_version');
+        const isWrite = response.headers.get('X-Invalidate-Dashboard-Cache') === 'true';
+        localStorage.setItem('dashboard_version', dashboardVersion);
+        // With no stored version yet only a write proves the cache is stale
+        if (cachedVersion !== dashboardVersion && (cachedVersion !== null || isWrite)) {
+            invalidateDashboardCache();
+        }
+    } else if (response.headers.get('X-Invalidate-Dashboard-Cache') === 'true') {
         invalidateDashboardCache();
     }
     
@@ -2663,8 +2672,15 @@ async function loadInvitationDetails(token) {
 }
 
 function handleLogout() {
+    // Close the previous user's event stream so it stops triggering refreshes
+    // and the next login can subscribe again
+    if (instagramEvents) {
+        instagramEvents.close();
+        instagramEvents = null;
+    }
     localStorage.removeItem('access_token');
     localStorage.removeItem('refresh_token');
+    localStorage.removeItem('dashboard_version');
     currentUser = null;
     navbarListenersSetup = false; // Reset the flag so listeners can be set up again on next login
     invitationDetailsLoaded = false; // Reset invitation flag
@@ -3259,6 +3275,48 @@ async function deletePost(postId) {
     }
 }
 
+// Live Instagram updates (server-sent events)
+let instagramEvents = null;
+const EVENTS_RECONNECT_DELAY = 10000; // ms
+
+async function subscribeInstagramEvents() {
+    if (instagramEvents || typeof EventSource === 'undefined') return;
+    if (!localStorage.getItem('access_token')) return;
+    
+    // EventSource can't send an Authorization header, so the stream is opened
+    // with a short-lived token issued for it rather than the access token
+    let token;
+    try {
+        const response = await apiCall('/instagram/events/token', { method: 'POST' });
+        if (!response.ok) return;
+        ({ token } = await response.json());
+    } catch (error) {
+        return;
+    }
+    if (instagramEvents) return; // Another call subscribed while this one waited
+    if (!localStorage.getItem('access_token')) return; // Logged out while waiting
+    
+    instagramEvents = new EventSource(`${API_BASE}/instagram/events?token=${encodeURIComponent(token)}`);
+    instagramEvents.addEventListener('instagram_cache_refreshed', () => {
+        // Only re-fetch when the posts list is on screen
+        if (document.getElementById('instagramPostsContainer')?.offsetParent) {
+            loadInstagramPosts();
+        }
+    });
+    instagramEvents.addEventListener('post_status', () => {
+        // A publish finished; loadDashboard skips itself when the dashboard isn't shown
+        loadDashboard();
+    });
+    instagramEvents.onerror = () => {
+        // The stream token is only good for opening a connection and the server
+        // ends streams periodically, so reconnect with a fresh token instead of
+        // letting the browser retry the old URL
+        instagramEvents.close();
+        instagramEvents = null;
+        setTimeout(subscribeInstagramEvents, EVENTS_RECONNECT_DELAY);
+    };
+}
+
 // Instagram Posts Functions
 async function loadInstagramPosts() {
     const container = document.getElementById('instagramPostsContainer');
@@ -3294,6 +3352,8 @@ async function loadInstagramPosts() {
             return;
         }
         
+        subscribeInstagramEvents();
+        
         if (!data.posts || data.posts.length === 0) {
             empty.style.display = 'block';
             return;
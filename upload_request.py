@@ -0,0 +1,65 @@
+"""
+Request class with a larger multipart read buffer.
+
+Werkzeug parses multipart bodies in 64 KiB chunks and scans each chunk for
+the boundary, which gets CPU-heavy on large single-file uploads such as mp4
+videos. Reading bigger chunks cuts the number of boundary scans and parser
+iterations per upload.
+"""
+
+import inspect
+
+from flask import Request
+from werkzeug.formparser import FormDataParser, MultiPartParser
+
+# Werkzeug rejects any single read larger than max_form_memory_size (500 KB by
+# default), so the buffer is capped well below that
+MULTIPART_BUFFER_SIZE = 256 * 1024  # 256 KiB
+
+
+def check_werkzeug_parser():
+    """
+    Fail at startup if Werkzeug's private parser API differs from the one
+    LargeBufferFormDataParser overrides (Werkzeug 3.1, pinned in requirements.txt).
+    """
+    override = getattr(FormDataParser, '_parse_multipart', None)
+    if override is None or list(inspect.signature(override).parameters) != [
+        'self', 'stream', 'mimetype', 'content_length', 'options'
+    ]:
+        raise RuntimeError('Unsupported Werkzeug version: FormDataParser._parse_multipart has changed')
+    parser_params = inspect.signature(MultiPartParser).parameters
+    if not {'buffer_size', 'max_form_parts'} <= set(parser_params):
+        raise RuntimeError('Unsupported Werkzeug version: MultiPartParser arguments have changed')
+
+
+class LargeBufferFormDataParser(FormDataParser):
+    """Form data parser that reads multipart bodies in large chunks"""
+
+    buffer_size = MULTIPART_BUFFER_SIZE
+
+    # Copy of FormDataParser._parse_multipart from Werkzeug 3.1 that passes buffer_size
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        buffer_size = self.buffer_size
+        if self.max_form_memory_size is not None:
+            buffer_size = min(buffer_size, self.max_form_memory_size // 2)
+
+        parser = MultiPartParser(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+            buffer_size=buffer_size,
+        )
+        boundary = options.get('boundary', '').encode('ascii')
+
+        if not boundary:
+            raise ValueError('Missing boundary')
+
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+
+class UploadRequest(Request):
+    """Flask request that uses LargeBufferFormDataParser for form bodies"""
+
+    form_data_parser_class = LargeBufferFormDataParser